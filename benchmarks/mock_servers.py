@@ -0,0 +1,414 @@
+"""
+Local stand-ins for the CRM portal, Lemitti, RD Station and Tallos, so the
+pipeline can be benchmarked without touching the live services.
+
+Each service runs in its own ThreadingHTTPServer on 127.0.0.1 with a random
+port and can be configured with artificial latency, an error rate and a
+429 (Too Many Requests) injection rate.
+"""
+import csv
+import datetime
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+SERVICES = ("crm", "lemitti", "rd_station", "tallos")
+
+FIRST_NAMES = ["ANA", "BRUNO", "CARLOS", "DANIELA", "EDUARDO", "FERNANDA", "GABRIEL",
+               "HELENA", "IGOR", "JULIANA", "LUCAS", "MARIA", "PEDRO", "RAFAELA"]
+LAST_NAMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "PEREIRA", "COSTA", "RODRIGUES",
+              "ALMEIDA", "NASCIMENTO", "LIMA", "ARAUJO", "FERREIRA", "CARVALHO"]
+CITIES = ["SAO LUIS", "IMPERATRIZ", "CAXIAS", "TIMON", "CODO", "BACABAL", "BALSAS"]
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.0         # seconds added to every response
+    jitter: float = 0.0          # extra random latency, uniform in [0, jitter]
+    error_rate: float = 0.0      # fraction of requests answered with 500
+    rate_429: float = 0.0        # fraction of requests answered with 429
+    hit_rate: float = 0.8        # fraction of Lemitti lookups that find data
+    total_records: int = 500     # size of the simulated CRM result set
+    fixtures_dir: str = None     # optional directory with recorded responses
+    seed: int = 42
+    rejected_phones: tuple = ()  # Tallos cel_phones refused with 422 (and left out of bulk answers)
+    bulk_status: int = None      # status the Tallos bulk contact endpoint answers with instead
+
+
+def fake_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def render_crm_page(page, total_records, uf="MA", seed=42):
+    """Build a results page with the same markup the portal returns"""
+    rng = random.Random(seed * 100003 + page)
+    start = (page - 1) * 10
+    items = []
+    for index in range(start, min(start + 10, total_records)):
+        items.append(
+            '<div class="resultado-item">'
+            f'<h4>{fake_name(rng)}</h4>'
+            f'<div class="row"><div class="col-md-4">CRM: {10000 + index}</div>'
+            '<div class="col-md-4">Situação: Ativo</div></div>'
+            f'<div class="endereco">Endereço: RUA {rng.randint(1, 999)}, CENTRO - '
+            f'{rng.choice(CITIES)}/{uf}</div>'
+            '</div>'
+        )
+    return (
+        "<html><body><form id=\"buscaForm\"></form><div id=\"resultados\">"
+        f"<div class=\"text-center\">{total_records} registros encontrados</div>"
+        + "".join(items)
+        + "</div></body></html>"
+    )
+
+
+# Synthetic chat history: one message per minute from this instant on
+CHAT_HISTORY_START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def chat_message(index, seed=42):
+    """
+    Message `index` of the synthetic history. Every customer gets a template
+    message and, for some of them, a reply a few minutes later
+    """
+    rng = random.Random(seed * 1000003 + index // 2)
+    customer = index // 2
+    created_at = CHAT_HISTORY_START + datetime.timedelta(minutes=index)
+    message = {
+        "_id": f"msg{index:08d}",
+        "customer": f"cus{customer:07d}",
+        "operator": f"op{rng.randint(1, 3)}",
+        "created_at": created_at.isoformat(),
+    }
+    template = f"tpl{rng.randint(1, 4)}"
+    replied = rng.random() < 0.35
+    if index % 2 == 0 or not replied:
+        message.update(sent_by="operator", template=template, message="Olá")
+    else:
+        message.update(sent_by="customer", message="Oi, tenho interesse")
+    return message
+
+
+def chat_history_page(page, limit, since, total, seed=42):
+    first = 0
+    if since:
+        elapsed = datetime.datetime.fromisoformat(since) - CHAT_HISTORY_START
+        first = max(0, -int(-elapsed.total_seconds() // 60))
+    start = first + (page - 1) * limit
+    return [chat_message(index, seed) for index in range(start, min(start + limit, total))]
+
+
+ENRICHED_COLUMNS = ["NOME", "CPF/CNPJ", "DDD", "FONE", "EMAIL-1", "CIDADE", "UF", "CEP",
+                    "FULL-LOGRADOURO", "CRM"]
+
+
+def enriched_row(index, seed=42):
+    """Row `index` of the synthetic enriched CSV; every row has its own phone and CRM"""
+    rng = random.Random(seed * 1000003 + index)
+    name = fake_name(rng)
+    return [
+        name, f"{rng.randrange(10**11):011d}", "98", f"9{index % 10**8:08d}",
+        f"{name.split()[0].lower()}{index}@example.com", rng.choice(CITIES), "MA",
+        f"65{rng.randrange(10**6):06d}", f"RUA {rng.choice(LAST_NAMES)}, {rng.randint(1, 999)}",
+        str(100000 + index),
+    ]
+
+
+def write_enriched_csv(path, rows, duplicate_rate=0.05, seed=42):
+    """
+    Synthetic enriched CSV of `rows` rows, written one row at a time. About
+    `duplicate_rate` of the rows repeat an earlier contact
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(ENRICHED_COLUMNS)
+        for index in range(rows):
+            repeat = index and rng.random() < duplicate_rate
+            writer.writerow(enriched_row(rng.randrange(index) if repeat else index, seed))
+
+
+SYLLABLES = [consonant + vowel for consonant in "BCDFGJLMNPRSTVXZ" for vowel in "AEIOU"] + ["NHA", "LHO", "QUE"]
+ACCENTED = {"A": "Á", "E": "É", "O": "Ó", "I": "Í"}
+
+
+def diverse_name(rng):
+    """Name with a made-up surname, so that names rarely repeat in large fixtures"""
+    surname = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    middle = rng.choice(["DA", "DE", "DOS", ""])
+    return " ".join(part for part in (rng.choice(FIRST_NAMES), middle, surname, rng.choice(LAST_NAMES)) if part)
+
+
+def _misspell(name, rng):
+    """The same name as typed elsewhere: an accent, a dropped particle or a typo"""
+    roll = rng.random()
+    if roll < 0.25:
+        return " ".join(word for word in name.split() if word not in ("DA", "DE", "DOS"))
+    if roll < 0.5:
+        return "".join(ACCENTED.get(char, char) if rng.random() < 0.15 else char for char in name).lower()
+    if roll < 0.7:
+        position = rng.randrange(len(name))
+        return name[:position] + rng.choice("AEIOURSTLMN") + name[position + 1:]
+    return name
+
+
+def matching_fixture(count, seed=42):
+    """
+    Enrichment export of `count` people, `count` CRM records of the same
+    people as typed in the CRM (shuffled, some without city) and, for each
+    record, its row in the export (-1 for the 10% who are not there)
+    """
+    rng = random.Random(seed)
+    export = []
+    for index in range(count):
+        export.append({
+            "NOME": diverse_name(rng), "CIDADE": rng.choice(CITIES), "UF": "MA",
+            "DDD": "98", "FONE": f"9{index:08d}", "FULL-LOGRADOURO": f"RUA {rng.choice(LAST_NAMES)}, {index}",
+        })
+    records, truth = [], []
+    for index in range(count):
+        if rng.random() < 0.1:
+            person, row = {"NOME": diverse_name(rng), "CIDADE": rng.choice(CITIES)}, -1
+        else:
+            row = rng.randrange(count)
+            person = export[row]
+        records.append({
+            "Nome": _misspell(person["NOME"], rng),
+            "Cidade": person["CIDADE"] if rng.random() < 0.8 else "",
+            "UF": "MA",
+        })
+        truth.append(row)
+    return pd.DataFrame(export), pd.DataFrame(records), np.array(truth)
+
+
+class OfflineTallos:
+    """
+    In-process Tallos client for the streaming send benchmark: with a million
+    rows the HTTP mock would be the bottleneck, so the calls only sleep
+    `latency` seconds
+    """
+    base_url = "http://offline"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def import_contacts(self, contacts, chunk_size=50, max_workers=8):
+        if self.latency:
+            time.sleep(self.latency)
+        ids = {contact["cel_phone"]: uuid.uuid4().hex[:24] for contact in contacts}
+        return {"ids": ids, "failed": [], "stats": {"created": len(ids), "failed": 0}}
+
+    def send_message(self, customer_id, message, operator_id=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return {"status": "success", "response": {"message_id": uuid.uuid4().hex[:24]}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "MockService/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    # Helpers
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body, ensure_ascii=False)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _fixture(self, name):
+        fixtures_dir = self.server.config.fixtures_dir
+        if not fixtures_dir:
+            return None
+        path = os.path.join(fixtures_dir, name)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        return None
+
+    def _injected_failure(self):
+        """Apply latency and maybe answer with an injected 429/500"""
+        config = self.server.config
+        with self.server.lock:
+            roll = self.server.rng.random()
+            extra = self.server.rng.uniform(0, config.jitter) if config.jitter else 0.0
+            status = None
+            if roll < config.rate_429:
+                status = 429
+            elif roll < config.rate_429 + config.error_rate:
+                status = 500
+            self.server.stats["requests"] += 1
+            if status:
+                self.server.stats[str(status)] += 1
+        delay = config.latency + extra
+        if delay:
+            time.sleep(delay)
+        if status == 429:
+            self._send(429, {"error": "Too Many Requests"})
+        elif status == 500:
+            self._send(500, {"error": "Internal Server Error"})
+        return status is not None
+
+    def do_GET(self):
+        if self._injected_failure():
+            return
+        self.server.route(self, "GET")
+
+    def do_POST(self):
+        if self._injected_failure():
+            return
+        self.server.route(self, "POST")
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, config=None):
+        if service not in SERVICES:
+            raise ValueError(f"Unknown service: {service}")
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.service = service
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "429": 0, "500": 0}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Routing
+
+    def route(self, handler, method):
+        path = urlparse(handler.path).path
+        getattr(self, f"_route_{self.service}")(handler, method, path)
+
+    def _route_crm(self, handler, method, path):
+        query = parse_qs(urlparse(handler.path).query)
+        page = int(query.get("page", ["1"])[0])
+        uf = query.get("uf", ["MA"])[0]
+        recorded = handler._fixture(f"crm_page_{page}.html")
+        handler._send(200, recorded or render_crm_page(page, self.config.total_records, uf, self.config.seed),
+                      content_type="text/html")
+
+    def _route_lemitti(self, handler, method, path):
+        if method != "POST" or not re.match(r"^/api/v1/consulta/(pessoa|empresa)/?$", path):
+            handler._send(404, {"error": "not found"})
+            return
+        body = handler._read_json()
+        with self.lock:
+            hit = self.rng.random() < self.config.hit_rate
+            phone = f"98{self.rng.randint(900000000, 999999999)}"
+        if not hit:
+            handler._send(200, {"nome": body.get("nome"), "telefones": [], "enderecos": []})
+            return
+        handler._send(200, {
+            "nome": body.get("nome"),
+            "telefones": [phone],
+            "enderecos": ["RUA DAS FLORES, 100 - CENTRO - SAO LUIS/MA"],
+        })
+
+    def _route_rd_station(self, handler, method, path):
+        if method == "POST" and path.rstrip("/") == "/platform/events":
+            handler._read_json()
+            handler._send(200, {"event_uuid": str(uuid.uuid4())})
+        else:
+            handler._send(404, {"error": "not found"})
+
+    def _route_tallos(self, handler, method, path):
+        rejected = set(self.config.rejected_phones)
+        if method == "POST" and path == "/v2/contacts/whatsapp-business-by-brokers":
+            body = handler._read_json()
+            if body.get("cel_phone") in rejected:
+                handler._send(422, {"error": "invalid cel_phone"})
+                return
+            handler._send(201, {"_id": uuid.uuid4().hex[:24], "full_name": body.get("full_name"),
+                                "cel_phone": body.get("cel_phone")})
+        elif method == "POST" and path == "/v2/contacts/whatsapp-business-by-brokers/bulk":
+            contacts = handler._read_json().get("contacts", [])
+            with self.lock:
+                self.stats["bulk_requests"] = self.stats.get("bulk_requests", 0) + 1
+            if self.config.bulk_status:
+                handler._send(self.config.bulk_status, {"error": "bulk unavailable"})
+                return
+            handler._send(201, [
+                {"_id": uuid.uuid4().hex[:24], "full_name": contact.get("full_name"),
+                 "cel_phone": contact.get("cel_phone")}
+                for contact in contacts if contact.get("cel_phone") not in rejected
+            ])
+        elif method == "POST" and re.match(r"^/v2/messages/[^/]+/send$", path):
+            handler._read_json()
+            handler._send(200, {"message_id": uuid.uuid4().hex[:24], "status": "sent"})
+        elif method == "GET" and path == "/v2/employees":
+            handler._send(200, handler._fixture("tallos_employees.json") or [
+                {"_id": "op1", "name": "Operador 1", "email": "op1@example.com"},
+            ])
+        elif method == "GET" and path == "/v2/template/all":
+            handler._send(200, handler._fixture("tallos_templates.json") or {
+                "templates": {"templates": [{"id": "tpl1", "content": "Olá {NOME}"}]},
+            })
+        elif method == "GET" and path == "/v2/whatsapp/integrations/official":
+            handler._send(200, [{"key": "int1", "label": "WhatsApp Principal"}])
+        elif method == "GET" and path == "/v1/chat/history":
+            recorded = handler._fixture("tallos_chat_history.json")
+            if recorded:
+                handler._send(200, recorded)
+                return
+            query = parse_qs(urlparse(handler.path).query)
+            handler._send(200, chat_history_page(
+                int(query.get("page", ["1"])[0]), int(query.get("limit", ["100"])[0]),
+                query.get("since", [None])[0], self.config.total_records * 4, self.config.seed,
+            ))
+        else:
+            handler._send(404, {"error": "not found"})
+
+
+def start_all(configs=None):
+    """Start one mock per service; `configs` maps service name to MockConfig"""
+    configs = configs or {}
+    return {service: MockServer(service, configs.get(service)).start() for service in SERVICES}
@@ -0,0 +1,383 @@
+"""
+Offline benchmark suite. Starts the local mock services, runs each benchmark
+against them and writes the results to a JSON file that can be compared with
+an earlier run:
+
+    python -m benchmarks.run --output bench_results.json
+    python -m benchmarks.run --latency 0.05 --rate-429 0.02 --compare old.json
+    python -m benchmarks.run --only stream_campaign --csv-rows 100000 --trace-memory
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+from benchmarks.mock_servers import (MockConfig, OfflineTallos, matching_fixture, render_crm_page, start_all,
+                                     write_enriched_csv)
+from campaign_stream import StreamingCampaign, iter_csv_chunks
+from chat_history import ChatHistoryStore
+from crm_scraper import parse_doctor_items
+from dedup import normalize_phone
+from enrichment_index import EnrichmentIndex
+from governor import HostPolicy, governor
+from lemitti import LemittiAPI
+from matching import NameIndex
+from metrics import metrics
+from pipeline import ENRICH_BATCH
+from tallos import TallosAPI
+
+BENCHMARKS = {}
+
+
+def benchmark(name, unit):
+    """
+    Register a benchmark; the function returns (operations, errors) or
+    (operations, errors, extra), where extra is stored with the result and
+    its "seconds", when present, replaces the measured time (setup excluded)
+    """
+    def decorator(func):
+        BENCHMARKS[name] = (func, unit)
+        return func
+    return decorator
+
+
+class BenchContext:
+    def __init__(self, servers, args):
+        self.servers = servers
+        self.args = args
+
+    def url(self, service):
+        return self.servers[service].url
+
+
+@benchmark("scrape", "pages/s")
+def bench_scrape(ctx):
+    """Fetch and parse CRM result pages over HTTP"""
+    pages = ctx.args.pages
+    errors = 0
+    with requests.Session() as session:
+        for page in range(1, pages + 1):
+            response = session.get(f"{ctx.url('crm')}/busca-medicos", params={"uf": "MA", "page": page})
+            if response.status_code != 200:
+                errors += 1
+                continue
+            parse_doctor_items(response.text, "MA")
+    return pages, errors
+
+
+@benchmark("parse", "rows/s")
+def bench_parse(ctx):
+    """Parse pre-rendered result pages, no I/O"""
+    html_pages = [render_crm_page(page, 10 * ctx.args.pages) for page in range(1, ctx.args.pages + 1)]
+    rows = 0
+    for html in html_pages:
+        rows += len(parse_doctor_items(html, "MA"))
+    return rows, 0
+
+
+@benchmark("enrichment", "lookups/s")
+def bench_enrichment(ctx):
+    """Lemitti name lookups"""
+    api = LemittiAPI("bench-token", base_url=ctx.url("lemitti"))
+    lookups = ctx.args.lookups
+    errors = 0
+    for index in range(lookups):
+        if api.search_doctor(f"MEDICO TESTE {index}") is None:
+            errors += 1
+    return lookups, errors
+
+
+@benchmark("tallos_send", "sends/s")
+def bench_tallos_send(ctx):
+    """create_contact followed by send_message, as the send loop does"""
+    api = TallosAPI("bench-token", base_url=ctx.url("tallos"))
+    sends = ctx.args.sends
+    errors = 0
+    for index in range(sends):
+        contact = api.create_contact({
+            "full_name": f"MEDICO TESTE {index}",
+            "cel_phone": f"+55 98 9{index % 10000:04d}-{index % 10000:04d}",
+            "integration": "int1",
+        })
+        if not contact or "_id" not in contact:
+            errors += 1
+            continue
+        result = api.send_message(contact["_id"], "Olá", operator_id="op1")
+        if result.get("status") != "success":
+            errors += 1
+    return sends, errors
+
+
+def _import_payloads(count):
+    # one contact in ten repeats a phone, as in real enriched files
+    return [
+        {"full_name": f"MEDICO TESTE {index}", "cel_phone": f"+55 98 9{index % (count - count // 10 or 1):04d}-0000",
+         "integration": "int1"}
+        for index in range(count)
+    ]
+
+
+def _bench_import(ctx, bulk_contacts_path=None):
+    api = TallosAPI("bench-token", base_url=ctx.url("tallos"), bulk_contacts_path=bulk_contacts_path)
+    result = api.import_contacts(_import_payloads(ctx.args.sends))
+    print(f"{'':<14} {result['stats']['requests']} requisições, "
+          f"{result['stats']['requests_avoided']} evitadas")
+    return result["stats"]["created"], result["stats"]["failed"]
+
+
+@benchmark("tallos_import", "contacts/s")
+def bench_tallos_import(ctx):
+    """Concurrent chunked contact import, one create_contact per unique phone"""
+    return _bench_import(ctx)
+
+
+@benchmark("tallos_import_bulk", "contacts/s")
+def bench_tallos_import_bulk(ctx):
+    """Contact import through the mock's batch endpoint"""
+    return _bench_import(ctx, "/v2/contacts/whatsapp-business-by-brokers/bulk")
+
+
+@benchmark("chat_sync", "messages/s")
+def bench_chat_sync(ctx):
+    """Full chat history sync into an empty store, an incremental re-sync and a reply-rate query"""
+    api = TallosAPI("bench-token", base_url=ctx.url("tallos"))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ChatHistoryStore(os.path.join(tmp, "chat.sqlite3"))
+        first = store.sync(api)
+        again = store.sync(api)
+        store.reply_rate("template_id")
+        store.reply_rate("operator_id")
+    return first["added"], int(again["added"] > 0)
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@benchmark("stream_campaign", "rows/s")
+def bench_stream_campaign(ctx):
+    """
+    Streaming send over a synthetic enriched CSV (--csv-rows, 5% duplicates)
+    with an in-process Tallos client, and the memory it took
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "enriquecido.csv")
+        write_enriched_csv(path, ctx.args.csv_rows, seed=ctx.args.seed)
+        file_mb = os.path.getsize(path) / 2**20
+        stream = StreamingCampaign(
+            OfflineTallos(), "Olá {NOME}, confirme seu endereço em {CIDADE}/{UF}",
+            "op1", {"key": "int1", "label": "WhatsApp Principal"}, queue_size=ctx.args.queue_size,
+        )
+        rss_before = _peak_rss_mb()
+        if ctx.args.trace_memory:
+            tracemalloc.start()
+        stats = stream.run(iter_csv_chunks(path), lambda record, outcome: None)
+        heap_peak = tracemalloc.get_traced_memory()[1] / 2**20 if ctx.args.trace_memory else None
+        tracemalloc.stop()
+        rss_after = _peak_rss_mb()
+
+    extra = {
+        "seconds": stats["seconds"],
+        "file_mb": round(file_mb, 1),
+        "rss_growth_mb": round(rss_after - rss_before, 1) if rss_after is not None else None,
+        "python_heap_peak_mb": round(heap_peak, 1) if heap_peak is not None else None,
+        "dedup_index_keys": len(stream.dedup),
+        "max_queued": stats["max_queued"],
+    }
+    print(f"{'':<14} arquivo de {extra['file_mb']} MB; memória: +{extra['rss_growth_mb']} MB de RSS"
+          + (f", pico de {extra['python_heap_peak_mb']} MB no heap Python" if heap_peak is not None else "")
+          + f"; até {stats['max_queued']} linhas nas filas")
+    return stats["rows"], stats["errors"], extra
+
+
+@benchmark("name_matching", "records/s")
+def bench_name_matching(ctx):
+    """
+    Reconcile --match-records CRM records (typos, accents, missing city)
+    against an enrichment export of the same size, index build included
+    """
+    export, records, truth = matching_fixture(ctx.args.match_records, ctx.args.seed)
+    started = time.perf_counter()
+    index = NameIndex.from_dataframe(export)
+    index_seconds = time.perf_counter() - started
+    matches = index.match_records(records)
+    seconds = time.perf_counter() - started
+
+    found = matches["row"].to_numpy()
+    correct = int((found == truth).sum())
+    wrong = int(((found != truth) & (found != -1)).sum())
+    missed = int(((found == -1) & (truth != -1)).sum())
+    print(f"{'':<14} {correct / len(truth):.1%} corretos, {wrong} trocados, {missed} não encontrados; "
+          f"índice em {index_seconds:.2f}s")
+    return len(truth), wrong + missed, {
+        "seconds": seconds, "index_seconds": round(index_seconds, 3),
+        "accuracy": round(correct / len(truth), 4), "wrong": wrong, "missed": missed,
+    }
+
+
+@benchmark("offline_enrich", "records/s")
+def bench_offline_enrich(ctx):
+    """
+    Enrichment of --match-records scraped doctors from a local Lemit export
+    on disk: one-time index build, then batched lookups with no network
+    """
+    export, records, truth = matching_fixture(ctx.args.match_records, ctx.args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lemit.csv")
+        export.to_csv(path, sep=";", index=False, encoding="utf-8")
+        started = time.perf_counter()
+        EnrichmentIndex.build(path, os.path.join(tmp, "index"))
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = EnrichmentIndex(os.path.join(tmp, "index"))
+        rows = records.to_dict("records")
+        contacts = []
+        for start in range(0, len(rows), ENRICH_BATCH):
+            contacts.extend(index.enrich(rows[start:start + ENRICH_BATCH]))
+        seconds = time.perf_counter() - started
+
+    expected = [normalize_phone(export["DDD"].iat[row], export["FONE"].iat[row]) if row >= 0 else None
+                for row in truth]
+    found = [contact["Telefone"] if contact else None for contact in contacts]
+    correct = sum(phone == want for phone, want in zip(found, expected))
+    wrong = sum(phone is not None and phone != want for phone, want in zip(found, expected))
+    missed = sum(phone is None and want is not None for phone, want in zip(found, expected))
+    print(f"{'':<14} {correct / len(truth):.1%} corretos, {wrong} trocados, {missed} não encontrados; "
+          f"indexação em {build_seconds:.2f}s")
+    return len(truth), wrong + missed, {
+        "seconds": seconds, "build_seconds": round(build_seconds, 3),
+        "accuracy": round(correct / len(truth), 4), "wrong": wrong, "missed": missed,
+    }
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        fixtures_dir=args.fixtures_dir,
+        seed=args.seed,
+    )
+    servers = start_all({service: config for service in ("crm", "lemitti", "rd_station", "tallos")})
+    for server in servers.values():
+        host = server.url.split("://", 1)[1]
+        governor.policies[host] = HostPolicy(initial_rate=args.initial_rate, max_rate=args.max_rate,
+                                             burst=max(1, int(args.initial_rate)))
+    ctx = BenchContext(servers, args)
+    results = {}
+    try:
+        selected = args.only or list(BENCHMARKS)
+        for name in selected:
+            func, unit = BENCHMARKS[name]
+            metrics.reset()
+            started = time.perf_counter()
+            operations, errors, *extra = func(ctx)
+            extra = extra[0] if extra else {}
+            elapsed = extra.pop("seconds", None) or time.perf_counter() - started
+            results[name] = {
+                "unit": unit,
+                "operations": operations,
+                "errors": errors,
+                "seconds": round(elapsed, 4),
+                "rate": round(operations / elapsed, 2) if elapsed else None,
+                **extra,
+                "metrics": metrics.snapshot(),
+                "governor": governor.stats(),
+            }
+            print(f"{name:<14} {results[name]['rate']:>12} {unit:<10} "
+                  f"({operations} ops, {errors} errors, {elapsed:.2f}s)")
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    return {
+        "version": args.label or git_version(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+            "rate_429": args.rate_429, "pages": args.pages, "lookups": args.lookups,
+            "sends": args.sends, "match_records": args.match_records, "csv_rows": args.csv_rows, "queue_size": args.queue_size, "seed": args.seed,
+            "initial_rate": args.initial_rate, "max_rate": args.max_rate,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline_path):
+    """Print the rate change of each benchmark relative to an earlier results file"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparado com {baseline.get('version')} ({baseline.get('timestamp')}):")
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or not old.get("rate") or not result.get("rate"):
+            print(f"{name:<14} sem referência")
+            continue
+        change = (result["rate"] - old["rate"]) / old["rate"] * 100
+        print(f"{name:<14} {old['rate']:>12} -> {result['rate']:<12} {change:+.1f}%")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks offline do pipeline")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="benchmarks a executar")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="arquivo de resultados anterior para comparação")
+    parser.add_argument("--label", help="identificador da versão (padrão: git describe)")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--fixtures-dir", help="diretório com páginas/respostas gravadas")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--sends", type=int, default=200)
+    parser.add_argument("--match-records", type=int, default=100_000, help="registros do name_matching")
+    parser.add_argument("--csv-rows", type=int, default=1_000_000, help="linhas do CSV do stream_campaign")
+    parser.add_argument("--queue-size", type=int, default=1_000, help="tamanho das filas do stream_campaign")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="mede o pico do heap Python no stream_campaign (bem mais lento)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--initial-rate", type=float, default=100.0, help="taxa inicial do governor (req/s)")
+    parser.add_argument("--max-rate", type=float, default=2000.0, help="taxa máxima do governor (req/s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(argv)
+    report = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados gravados em {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
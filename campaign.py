@@ -0,0 +1,175 @@
+import logging
+import re
+
+import pandas as pd
+
+from dedup import Deduplicator, cell_text, normalize_phone
+from governor import governor
+from log_utils import LazyPayload, log_sampled
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# {COLUMN} placeholders; WhatsApp template variables ({{1}}) are left alone
+_PLACEHOLDER = re.compile(r"(?<!\{)\{([^{}\s]+)\}(?!\})")
+
+# Calls made per contact: create_contact + send_message
+CALLS_PER_CONTACT = 2
+
+# Per-call latency assumed by the estimate before any call was measured
+DEFAULT_CALL_SECONDS = 0.5
+
+
+def format_phone(contact_data: dict) -> str:
+    """
+    Tallos cel_phone ("+55 98 99999-9999") from the DDD and FONE columns
+
+    Raises:
+        ValueError: when DDD + FONE is not an 11-digit mobile number
+    """
+    phone = normalize_phone(contact_data.get('DDD'), contact_data.get('FONE'))
+    if len(phone) != 11:
+        raise ValueError(f"telefone inválido ({len(phone)} dígitos): {phone or 'vazio'}")
+    return f"+55 {phone[:2]} {phone[2:7]}-{phone[7:11]}"
+
+
+def build_contact_payload(contact_data: dict, selected_integration: dict) -> dict:
+    """
+    Format contact data for Tallos API
+    """
+    if not selected_integration:
+        raise ValueError("nenhuma integração do WhatsApp selecionada")
+
+    return {
+        "full_name": contact_data.get('NOME', ''),
+        "cel_phone": format_phone(contact_data),
+        "integration": selected_integration["key"],
+    }
+
+
+def missing_placeholders(message_template: str, contact_data: dict) -> list:
+    """Placeholders of the template without a value for this contact"""
+    return [
+        name for name in dict.fromkeys(_PLACEHOLDER.findall(message_template))
+        if not cell_text(contact_data.get(name))
+    ]
+
+
+def render_message(message_template: str, contact_data: dict) -> str:
+    """Replace {COLUMN} placeholders with the contact's values"""
+    def value(match):
+        name = match.group(1)
+        return cell_text(contact_data[name]) if name in contact_data else match.group(0)
+    return _PLACEHOLDER.sub(value, message_template)
+
+
+def validate_contact(contact_data: dict, message_template: str, selected_integration: dict) -> list:
+    """Problems that would make the send of this contact fail or go out wrong"""
+    problems = []
+    try:
+        build_contact_payload(contact_data, selected_integration)
+    except (ValueError, KeyError, TypeError) as e:
+        problems.append(str(e))
+    missing = missing_placeholders(message_template, contact_data)
+    if missing:
+        problems.append("sem valor para " + ", ".join(f"{{{name}}}" for name in missing))
+    return problems
+
+
+def estimate_send_seconds(contacts: int, base_url: str) -> float:
+    """
+    Expected duration of a send job, from the measured Tallos latencies and
+    the current request rate the governor allows for the host
+    """
+    stages = metrics.snapshot()["stages"]
+    per_contact = sum(
+        (stages.get(name) or {}).get("p50") or DEFAULT_CALL_SECONDS
+        for name in ("tallos.create_contact", "tallos.send_message")
+    )
+    rate = governor.host(base_url).stats()["rate"]
+    if rate:
+        per_contact = max(per_contact, CALLS_PER_CONTACT / rate)
+    return contacts * per_contact
+
+
+def dry_run(df: pd.DataFrame, message_template: str, selected_integration: dict,
+            dedup_stage: str = "dry_run") -> pd.DataFrame:
+    """
+    Run the send pipeline over the DataFrame without any API call: dedup,
+    payload building, phone validation and template rendering
+
+    Returns one row per contact with status "ok", "erro" or "duplicado",
+    the problems found and the message that would be sent
+    """
+    unique_index = Deduplicator(dedup_stage, calls_per_record=CALLS_PER_CONTACT).filter_dataframe(df).index
+    duplicated = ~df.index.isin(unique_index)
+
+    rows = []
+    for is_duplicate, contact_data in zip(duplicated, df.to_dict("records")):
+        problems = validate_contact(contact_data, message_template, selected_integration)
+        if is_duplicate:
+            status = "duplicado"
+        else:
+            status = "erro" if problems else "ok"
+        try:
+            phone = format_phone(contact_data)
+        except ValueError:
+            phone = normalize_phone(contact_data.get('DDD'), contact_data.get('FONE'))
+        rows.append({
+            "NOME": contact_data.get('NOME', ''),
+            "telefone": phone,
+            "status": status,
+            "problemas": "; ".join(problems),
+            "mensagem": render_message(message_template, contact_data),
+        })
+    return pd.DataFrame(rows, index=df.index, columns=["NOME", "telefone", "status", "problemas", "mensagem"])
+
+
+def send_contact_message(tallos_api, contact_data: dict, message_template: str,
+                         selected_operator_id: str, selected_integration: dict,
+                         customer_id: str = None) -> dict:
+    """
+    Create the contact and send it the rendered message. With customer_id
+    (contact already imported) only the message is sent
+
+    Returns:
+        dict: {"status": "success", "customer_id": ..., "response": ...} or
+              {"status": "error", "message": ...}
+    """
+    nome = contact_data.get('NOME', 'Unknown')
+    try:
+        contact_payload = build_contact_payload(contact_data, selected_integration)
+    except Exception as e:
+        return {"status": "error", "message": f"Erro ao formatar dados do contato {nome}: {str(e)}"}
+
+    missing = missing_placeholders(message_template, contact_data)
+    if missing:
+        return {"status": "error",
+                "message": f"Placeholders sem valor para {nome}: {', '.join(missing)}"}
+
+    if customer_id:
+        contact_response = {'_id': customer_id}
+    else:
+        contact_response = tallos_api.create_contact(contact_payload)
+    if not contact_response or '_id' not in contact_response:
+        return {"status": "error", "message": f"Erro ao criar contato: {nome}"}
+
+    formatted_message = render_message(message_template, contact_data)
+
+    log_sampled(logger, logging.INFO, "tallos.send",
+                "Sending message to %s", contact_response['_id'])
+    logger.debug("Message template: %s", LazyPayload(message_template))
+    message_response = tallos_api.send_message(
+        customer_id=contact_response['_id'],
+        message=formatted_message,
+        operator_id=selected_operator_id
+    )
+    logger.debug("Message response: %s", LazyPayload(message_response))
+
+    if message_response and message_response.get('status') == 'success':
+        return {
+            "status": "success",
+            "customer_id": contact_response['_id'],
+            "response": message_response.get('response'),
+        }
+    return {"status": "error", "message": f"Erro ao enviar mensagem para: {nome}"}
@@ -0,0 +1,219 @@
+"""
+Memory-bounded campaign send, from the enriched CSV to send_message.
+
+    CSV chunks -> dedup + payload -> [queue] -> create_contact batches
+               -> [queue] -> send_message -> on_result
+
+The CSV is read in chunks and every stage hands work to the next through a
+bounded queue, so a slow stage blocks the ones before it (backpressure) and
+the rows held in memory depend on the chunk and queue sizes, not on the
+file size. Only the dedup index grows with the file: one 64-bit hash per
+distinct contact key.
+"""
+import logging
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from campaign import CALLS_PER_CONTACT, build_contact_payload, missing_placeholders, send_contact_message
+from dedup import Deduplicator
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 5_000
+QUEUE_SIZE = 1_000
+
+_DONE = object()
+
+
+def iter_csv_chunks(source, chunksize=CHUNK_ROWS):
+    """
+    DataFrames of `chunksize` rows of an enriched CSV (path or file object).
+    Every column is read as text, so DDD/FONE keep their digits as written
+    """
+    reader = pd.read_csv(source, sep=';', encoding='utf-8', chunksize=chunksize,
+                         dtype=str, keep_default_na=False)
+    with reader:
+        yield from reader
+
+
+class StreamingCampaign:
+    """
+    Threads of each stage: the caller's thread reads and validates, then
+    `create_workers` import contacts in batches of `contact_batch`,
+    `send_workers` send the messages and one more thread hands each
+    outcome to on_result
+    """
+
+    def __init__(self, tallos_api, message_template, selected_operator_id, selected_integration,
+                 queue_size=QUEUE_SIZE, contact_batch=50, create_workers=2, send_workers=4,
+                 should_stop=None, dedup_stage="tallos"):
+        self.tallos_api = tallos_api
+        self.message_template = message_template
+        self.operator_id = selected_operator_id
+        self.integration = selected_integration
+        self.contact_batch = contact_batch
+        self.create_workers = create_workers
+        self.send_workers = send_workers
+        self.should_stop = should_stop or (lambda: False)
+        self.dedup = Deduplicator(dedup_stage, calls_per_record=CALLS_PER_CONTACT)
+
+        self._to_create = queue.Queue(maxsize=queue_size)
+        self._to_send = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._on_result = None
+        self.stats = {"rows": 0, "duplicates": 0, "invalid": 0, "created": 0,
+                      "sent": 0, "errors": 0, "max_queued": 0}
+
+    def _finish(self, record, outcome):
+        """Count the outcome and queue it for on_result"""
+        with self._lock:
+            self.stats["sent" if outcome["status"] == "success" else "errors"] += 1
+        self._results.put((record, outcome))
+
+    def _report_worker(self):
+        # on_result may write to a database; running it here keeps the senders off that I/O
+        while True:
+            item = self._results.get()
+            if item is _DONE:
+                return
+            record, outcome = item
+            try:
+                self._on_result(record, outcome)
+            except Exception:
+                # A failing callback must not stop the results of the other contacts
+                logger.exception("Falha ao registrar o resultado de %s", record.get('NOME', 'Unknown'))
+
+    def _put(self, target, item):
+        # Blocks while the next stage is behind, but keeps checking for cancellation
+        while not self.should_stop():
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, chunks):
+        for chunk in chunks:
+            if self.should_stop():
+                return
+            unique = self.dedup.filter_dataframe(chunk)
+            with self._lock:
+                self.stats["rows"] += len(chunk)
+                self.stats["duplicates"] += len(chunk) - len(unique)
+            for record in unique.to_dict("records"):
+                nome = record.get('NOME', 'Unknown')
+                try:
+                    payload = build_contact_payload(record, self.integration)
+                except (ValueError, KeyError, TypeError) as e:
+                    payload, problem = None, f"Erro ao formatar dados do contato {nome}: {e}"
+                else:
+                    missing = missing_placeholders(self.message_template, record)
+                    problem = f"Placeholders sem valor para {nome}: {', '.join(missing)}" if missing else None
+                if problem:
+                    with self._lock:
+                        self.stats["invalid"] += 1
+                    self._finish(record, {"status": "error", "message": problem})
+                    continue
+                if not self._put(self._to_create, (record, payload)):
+                    return
+            queued = self._to_create.qsize() + self._to_send.qsize()
+            with self._lock:
+                self.stats["max_queued"] = max(self.stats["max_queued"], queued)
+
+    def _create_worker(self):
+        batch = []
+        while True:
+            item = self._to_create.get()
+            if item is not _DONE:
+                batch.append(item)
+            # Flush full batches, and partial ones when the reader is behind
+            if batch and (item is _DONE or len(batch) >= self.contact_batch or self._to_create.empty()):
+                try:
+                    self._create_batch(batch)
+                except Exception:
+                    logger.exception("Falha ao processar lote de %d contatos", len(batch))
+                batch = []
+            if item is _DONE:
+                return
+
+    def _create_batch(self, batch):
+        if self.should_stop():
+            return
+        try:
+            imported = self.tallos_api.import_contacts([payload for _, payload in batch], max_workers=1)
+        except Exception:
+            logger.exception("Falha ao importar %d contatos", len(batch))
+            imported = {"ids": {}}
+        customer_ids = imported["ids"]
+        with self._lock:
+            self.stats["created"] += len(customer_ids)
+        for record, payload in batch:
+            customer_id = customer_ids.get(payload["cel_phone"])
+            if customer_id is None:
+                self._finish(record, {"status": "error",
+                                      "message": f"Erro ao criar contato: {record.get('NOME', 'Unknown')}"})
+            elif not self._put(self._to_send, (record, customer_id)):
+                return
+
+    @staticmethod
+    def _close(target, workers):
+        """Send one _DONE per worker and wait for them; gives up on the queue once none is left to drain it"""
+        for _ in workers:
+            while any(thread.is_alive() for thread in workers):
+                try:
+                    target.put(_DONE, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+        for thread in workers:
+            thread.join()
+
+    def _send_worker(self):
+        while True:
+            item = self._to_send.get()
+            if item is _DONE:
+                return
+            if self.should_stop():
+                continue
+            record, customer_id = item
+            try:
+                outcome = send_contact_message(
+                    self.tallos_api, record, self.message_template, self.operator_id, self.integration,
+                    customer_id=customer_id
+                )
+            except Exception as e:
+                outcome = {"status": "error", "message": f"Erro ao enviar mensagem: {e}"}
+            self._finish(record, outcome)
+
+    def run(self, chunks, on_result):
+        """
+        Push every chunk through the stages. on_result(record, outcome) is
+        called once per unique contact, always from the same thread, with the
+        same outcome dicts as send_contact_message. Returns the stats
+        """
+        self._on_result = on_result
+        started = time.perf_counter()
+        creators = [threading.Thread(target=self._create_worker, name=f"campaign-create-{i}", daemon=True)
+                    for i in range(self.create_workers)]
+        senders = [threading.Thread(target=self._send_worker, name=f"campaign-send-{i}", daemon=True)
+                   for i in range(self.send_workers)]
+        reporter = threading.Thread(target=self._report_worker, name="campaign-results", daemon=True)
+        for thread in creators + senders + [reporter]:
+            thread.start()
+        try:
+            self._produce(chunks)
+        finally:
+            # Each stage stops once the one before it has finished and its queue is drained
+            self._close(self._to_create, creators)
+            self._close(self._to_send, senders)
+            self._close(self._results, [reporter])
+        seconds = time.perf_counter() - started
+        self.stats["seconds"] = round(seconds, 3)
+        self.stats["rows_per_s"] = round(self.stats["rows"] / seconds, 1) if seconds else None
+        logger.info("Envio em fluxo concluído: %s", self.stats)
+        return self.stats
@@ -0,0 +1,108 @@
+"""
+Tallos operators, templates and WhatsApp integrations indexed by id.
+
+Built once per metadata refresh, so the send UI resolves labels and
+contents with dict lookups instead of scanning the API lists each time a
+selectbox option is drawn.
+"""
+import logging
+
+from dedup import normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Characters of the template shown in lists and selectboxes
+PREVIEW_LENGTH = 50
+LABEL_LENGTH = 100
+
+
+def _shorten(text, length):
+    return text[:length] + "..." if len(text) > length else text
+
+
+def flatten_templates(templates_response):
+    """
+    Templates of a /v2/template/all response as a list of dicts with id,
+    content (preview), full_content and content_media
+    """
+    if not isinstance(templates_response, dict):
+        return []
+    templates = templates_response.get('templates', {})
+    template_list = templates.get('templates', []) if isinstance(templates, dict) else templates
+    if not isinstance(template_list, list):
+        return []
+
+    flattened = []
+    for template in template_list:
+        if isinstance(template, dict):
+            content = template.get('content') or ''
+            flattened.append({
+                'id': template.get('id'),
+                'content': _shorten(content, PREVIEW_LENGTH),
+                'full_content': content,
+                'content_media': template.get('content_media'),
+            })
+    return flattened
+
+
+class TallosCatalog:
+    def __init__(self, employees=None, templates_response=None, integrations=None):
+        self.employees_response = employees
+        self.templates_response = templates_response
+
+        self.operators = {}
+        self.operator_labels = {}
+        for employee in employees or []:
+            if not isinstance(employee, dict):
+                continue
+            operator_id = employee.get('_id') or employee.get('id')
+            if operator_id:
+                self.operators[operator_id] = employee
+                self.operator_labels[operator_id] = (
+                    f"{employee.get('name', 'Sem nome')} ({employee.get('email', '')})"
+                )
+
+        self.template_list = flatten_templates(templates_response)
+        self.templates = {template['id']: template for template in self.template_list}
+        self.template_labels = {
+            template_id: _shorten(template['full_content'], LABEL_LENGTH)
+            for template_id, template in self.templates.items()
+        }
+        # Accent-folded content for the template search
+        self._search_text = {
+            template_id: normalize_name(template['full_content'])
+            for template_id, template in self.templates.items()
+        }
+
+        self.integrations = {}
+        for integration in integrations or []:
+            if isinstance(integration, dict) and integration.get('key'):
+                self.integrations[integration['key']] = {
+                    'key': integration['key'],
+                    'label': integration.get('label', 'Unnamed'),
+                }
+
+    @classmethod
+    def load(cls, tallos_api):
+        """Fetch employees, templates and integrations from the API"""
+        employees = tallos_api.get_employees()
+        logger.debug("Employees loaded: %d", len(employees or []))
+        templates_response = tallos_api.get_templates()
+        integrations = tallos_api.get_whatsapp_integrations()
+        catalog = cls(employees, templates_response, integrations)
+        logger.info(
+            "Catálogo Tallos: %d operadores, %d templates, %d integrações",
+            len(catalog.operators), len(catalog.templates), len(catalog.integrations),
+        )
+        return catalog
+
+    def search_templates(self, query="", limit=50):
+        """Ids of the templates containing every word of the query, at most `limit`"""
+        terms = normalize_name(query).split()
+        matches = []
+        for template_id, text in self._search_text.items():
+            if all(term in text for term in terms):
+                matches.append(template_id)
+                if len(matches) >= limit:
+                    break
+        return matches
@@ -0,0 +1,322 @@
+"""
+Local copy of the Tallos chat history, kept up to date incrementally.
+
+Each sync asks the API only for messages created since the high-water mark
+of the previous sync and appends them to a SQLite table indexed by customer,
+template and operator, so reply-rate queries run locally instead of
+re-downloading the whole history.
+
+The same database keeps every message sent by a campaign. After each sync
+the sends are joined with the new messages, by customer id, to record when
+each one was delivered and answered.
+"""
+import datetime
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CHAT_DB_PATH = os.environ.get("CHAT_DB_PATH", "chat_history.sqlite3")
+
+# Messages from the customer; everything else counts as outbound
+CUSTOMER = "customer"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    customer_id TEXT,
+    operator_id TEXT,
+    template_id TEXT,
+    sent_by TEXT,
+    created_at REAL NOT NULL,
+    body TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_customer ON messages (customer_id, sent_by, created_at);
+CREATE INDEX IF NOT EXISTS messages_template ON messages (template_id);
+CREATE INDEX IF NOT EXISTS messages_operator ON messages (operator_id);
+CREATE TABLE IF NOT EXISTS sends (
+    campaign_id TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    template_id TEXT,
+    operator_id TEXT,
+    message_id TEXT,
+    sent_at REAL NOT NULL,
+    delivered_at REAL,
+    replied_at REAL
+);
+CREATE INDEX IF NOT EXISTS sends_customer ON sends (customer_id, sent_at);
+CREATE INDEX IF NOT EXISTS sends_campaign ON sends (campaign_id);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+REPLY_RATE_GROUPS = ("template_id", "operator_id")
+
+# A history message this many seconds before the recorded send time still
+# counts as its delivery (clock skew between us and Tallos)
+DELIVERY_TOLERANCE = 60
+
+
+def _ref(value):
+    """Id of a field that may come as a plain id or as an embedded document"""
+    if isinstance(value, dict):
+        value = value.get("_id") or value.get("id")
+    return str(value) if value not in (None, "") else None
+
+
+def _timestamp(value):
+    """Epoch seconds from an ISO string or an epoch number (seconds or milliseconds)"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000 if value > 1e12 else float(value)
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def _isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+def extract_messages(response):
+    """Message list of a chat history page (bare list or wrapped in data/messages/history)"""
+    if isinstance(response, dict):
+        for key in ("data", "messages", "history", "docs"):
+            if isinstance(response.get(key), list):
+                return response[key]
+        return []
+    return response if isinstance(response, list) else []
+
+
+def message_row(message):
+    """(id, customer_id, operator_id, template_id, sent_by, created_at, body) or None"""
+    message_id = _ref(message.get("_id") or message.get("id"))
+    created_at = _timestamp(message.get("created_at") or message.get("createdAt") or message.get("date"))
+    if not message_id or created_at is None:
+        return None
+    return (
+        message_id,
+        _ref(message.get("customer") or message.get("customer_id")),
+        _ref(message.get("operator") or message.get("operator_id")),
+        _ref(message.get("template") or message.get("template_id")),
+        message.get("sent_by"),
+        created_at,
+        message.get("message") or message.get("text"),
+    )
+
+
+class ChatHistoryStore:
+    def __init__(self, db_path=CHAT_DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _state(conn, name, default=None):
+        row = conn.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return float(row[0]) if row else default
+
+    @staticmethod
+    def _set_state(conn, name, value):
+        conn.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, repr(value)))
+
+    @property
+    def high_water_mark(self):
+        """created_at (epoch seconds) of the newest message already stored"""
+        with self._connect() as conn:
+            return self._state(conn, "high_water_mark")
+
+    def message_count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def add_messages(self, messages):
+        """Store new messages; ones already present are ignored. Returns how many were added"""
+        rows = [row for row in map(message_row, messages) if row]
+        if not rows:
+            return 0
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            return conn.total_changes - before
+
+    def sync(self, tallos_api, page_size=200, should_stop=None, on_page=None):
+        """
+        Page through the history created since the last sync and append it
+
+        The high-water mark only moves once every page was read, so an
+        interrupted sync is simply repeated from the same point; messages
+        seen twice are dropped by the primary key
+        """
+        since = self.high_water_mark
+        newest = since
+        page = 1
+        fetched = added = 0
+        while True:
+            if should_stop and should_stop():
+                return {"pages": page - 1, "fetched": fetched, "added": added, "complete": False}
+            response = tallos_api.get_chat_history(
+                page=page, limit=page_size, since=_isoformat(since) if since else None
+            )
+            if response is None:
+                raise RuntimeError(f"Falha ao buscar a página {page} do histórico")
+            messages = extract_messages(response)
+            fetched += len(messages)
+            added += self.add_messages(messages)
+            for message in messages:
+                row = message_row(message)
+                if row and (newest is None or row[5] > newest):
+                    newest = row[5]
+            if on_page:
+                on_page(page, fetched, added)
+            if len(messages) < page_size:
+                break
+            page += 1
+
+        if newest is not None and newest != since:
+            with self._connect() as conn:
+                self._set_state(conn, "high_water_mark", newest)
+        logger.info("Histórico sincronizado: %d páginas, %d mensagens novas", page, added)
+        return {"pages": page, "fetched": fetched, "added": added, "complete": True,
+                "joined": self.update_campaign_status()}
+
+    def record_sends(self, sends):
+        """
+        Store the messages sent by a campaign: dicts with campaign_id,
+        customer_id, template_id, operator_id, message_id and sent_at (epoch seconds)
+        """
+        rows = [
+            (send["campaign_id"], send["customer_id"], send.get("template_id"), send.get("operator_id"),
+             send.get("message_id"), send["sent_at"])
+            for send in sends
+        ]
+        if rows:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO sends (campaign_id, customer_id, template_id, operator_id, message_id, sent_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        return len(rows)
+
+    def update_campaign_status(self):
+        """
+        Fill delivered_at/replied_at of the sends still waiting for them
+
+        Only sends recorded since the previous join, or whose customer got a
+        message since then, are looked at; each lookup goes through the
+        customer index, so the cost follows the new data and not the size of
+        the campaigns. Returns how many sends were updated
+        """
+        with self._connect() as conn:
+            message_mark = self._state(conn, "join_message_rowid", 0)
+            send_mark = self._state(conn, "join_send_rowid", 0)
+            last_message = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM messages").fetchone()[0]
+            last_send = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM sends").fetchone()[0]
+            if last_message == message_mark and last_send == send_mark:
+                return 0
+
+            conn.execute("DROP TABLE IF EXISTS temp.touched")
+            conn.execute(
+                "CREATE TEMP TABLE touched AS SELECT DISTINCT customer_id FROM messages WHERE rowid > ?",
+                (message_mark,),
+            )
+            updated = conn.execute(
+                """
+                UPDATE sends SET
+                    delivered_at = COALESCE(delivered_at, (
+                        SELECT MIN(m.created_at) FROM messages m
+                        WHERE m.customer_id = sends.customer_id
+                          AND m.sent_by != :customer
+                          AND (m.id = sends.message_id OR m.created_at >= sends.sent_at - :tolerance)
+                    )),
+                    replied_at = (
+                        SELECT MIN(m.created_at) FROM messages m
+                        WHERE m.customer_id = sends.customer_id
+                          AND m.sent_by = :customer
+                          AND m.created_at > sends.sent_at
+                    )
+                WHERE replied_at IS NULL
+                  AND (rowid > :send_mark OR customer_id IN (SELECT customer_id FROM temp.touched))
+                """,
+                {"customer": CUSTOMER, "tolerance": DELIVERY_TOLERANCE, "send_mark": send_mark},
+            ).rowcount
+            conn.execute("DROP TABLE temp.touched")
+            self._set_state(conn, "join_message_rowid", last_message)
+            self._set_state(conn, "join_send_rowid", last_send)
+        return updated
+
+    def campaign_report(self):
+        """Delivery and reply counts and rates per campaign (send job)"""
+        self.update_campaign_status()
+        query = """
+            SELECT campaign_id AS campanha,
+                   MIN(template_id) AS template_id,
+                   MIN(operator_id) AS operator_id,
+                   MIN(sent_at) AS inicio,
+                   COUNT(*) AS enviadas,
+                   COUNT(delivered_at) AS entregues,
+                   COUNT(replied_at) AS respondidas,
+                   AVG(replied_at - sent_at) / 3600.0 AS horas_ate_resposta
+            FROM sends
+            GROUP BY campaign_id
+            ORDER BY inicio DESC
+        """
+        with self._connect() as conn:
+            df = pd.read_sql_query(query, conn)
+        df["inicio"] = pd.to_datetime(df["inicio"], unit="s")
+        df["taxa_entrega"] = (df["entregues"] / df["enviadas"]).round(4)
+        df["taxa_resposta"] = (df["respondidas"] / df["enviadas"]).round(4)
+        df["horas_ate_resposta"] = pd.to_numeric(df["horas_ate_resposta"]).round(1)
+        return df
+
+    def reply_rate(self, by="template_id", window_hours=72, since=None):
+        """
+        Outbound messages, replies and reply rate grouped by template or operator
+
+        An outbound message counts as replied when the same customer writes
+        back within `window_hours`
+        """
+        if by not in REPLY_RATE_GROUPS:
+            raise ValueError(f"by must be one of {REPLY_RATE_GROUPS}")
+        query = f"""
+            SELECT o.{by} AS {by},
+                   COUNT(*) AS enviadas,
+                   SUM(EXISTS (
+                       SELECT 1 FROM messages r
+                       WHERE r.customer_id = o.customer_id
+                         AND r.sent_by = :customer
+                         AND r.created_at > o.created_at
+                         AND r.created_at <= o.created_at + :window
+                   )) AS respondidas
+            FROM messages o
+            WHERE o.sent_by != :customer AND o.{by} IS NOT NULL AND o.created_at >= :since
+            GROUP BY o.{by}
+            ORDER BY enviadas DESC
+        """
+        params = {"customer": CUSTOMER, "window": window_hours * 3600, "since": _timestamp(since) or 0}
+        with self._connect() as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+        df["taxa_resposta"] = (df["respondidas"] / df["enviadas"]).round(4)
+        return df
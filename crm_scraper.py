@@ -0,0 +1,272 @@
+import logging
+import threading
+import time
+from bs4 import BeautifulSoup
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait, Select
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import NoSuchElementException
+from webdriver_manager.chrome import ChromeDriverManager
+from metrics import metrics
+from dedup import Deduplicator
+
+logger = logging.getLogger(__name__)
+
+# Portal de busca do CRM
+CRM_SEARCH_URL = "https://crmma.org.br/busca-medicos"
+
+# The portal lists 10 doctors per results page
+RESULTS_PER_PAGE = 10
+
+UFS = ["AC", "AL", "AP", "AM", "BA", "CE", "DF", "ES", "GO", "MA", "MT", "MS",
+       "MG", "PA", "PB", "PR", "PE", "PI", "RJ", "RN", "RS", "RO", "RR", "SC",
+       "SP", "SE", "TO"]
+
+
+def parse_doctor_items(page_source, uf):
+    """
+    Parse the doctors listed in a CRM results page
+    """
+    page_results = []
+    soup = BeautifulSoup(page_source, 'html.parser')
+    doctor_items = soup.find_all('div', class_='resultado-item')
+
+    for item in doctor_items:
+        try:
+            name = item.find('h4').text.strip()
+            crm = item.find('div', class_='col-md-4').text.strip().split(':')[1].strip()
+
+            address_div = item.find('div', class_='endereco')
+            full_address = address_div.text.strip().split(':')[1].strip() if address_div else "Não disponível"
+
+            # Parse address components
+            address_parts = full_address.split(' - ')
+            city_uf = address_parts[-1].strip() if len(address_parts) > 1 else ""
+
+            # Extract city and UF, always using search UF
+            if '/' in city_uf:
+                city = city_uf.split('/')[0].strip()
+            else:
+                city = city_uf.strip() if city_uf else "N/A"
+
+            state = uf  # Always use the UF from search parameter
+            page_results.append({
+                "Nome": name,
+                "CRM": crm,
+                "Cidade": city,
+                "UF": state,
+                "DT_NASCIMENTO": ""
+            })
+
+        except Exception as e:
+            logger.error(f"Erro ao processar médico: {str(e)}")
+            continue
+
+    return page_results
+
+
+def total_pages_for(total_records):
+    """Number of result pages for a given record count"""
+    return (total_records + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def chrome_options():
+    options = Options()
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option('useAutomationExtension', False)
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    return options
+
+
+def create_driver():
+    """New Chrome driver; the ChromeDriver binary is installed once per process"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = Service(ChromeDriverManager().install())
+    return webdriver.Chrome(service=_service, options=chrome_options())
+
+
+def _wait_loading(driver):
+    WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.CSS_SELECTOR, ".loading"))
+    )
+    WebDriverWait(driver, 30).until(
+        EC.invisibility_of_element_located((By.CSS_SELECTOR, ".loading"))
+    )
+
+
+def _results_counter_ready(driver):
+    """Counter element once it shows the number of records, False while still loading"""
+    elements = driver.find_elements(By.CSS_SELECTOR, "#resultados .text-center")
+    if elements and elements[0].text.strip()[:1].isdigit():
+        return elements[0]
+    return False
+
+
+def _open_search(driver, nome, uf, situacao="ATIVO", especialidade="", area_atuacao=""):
+    """Fill in the search form, submit it and return the number of records found"""
+    logger.info(f"Iniciando busca - UF: {uf}, Nome: {nome}")
+
+    # Open website
+    with metrics.stage("scrape.open"):
+        driver.get(CRM_SEARCH_URL)
+
+        # Wait for form and fill fields
+        WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.ID, "buscaForm"))
+        )
+
+    if nome:
+        nome_field = driver.find_element(By.NAME, "nome")
+        nome_field.send_keys(nome)
+        logger.info(f"Nome preenchido: {nome}")
+
+    # Select UF
+    uf_select = Select(driver.find_element(By.NAME, "uf"))
+    uf_select.select_by_visible_text(uf)
+    logger.info(f"UF selecionada: {uf}")
+
+    time.sleep(5)
+
+    # Handle specialty and area selections
+    if especialidade:
+        specialty_select = Select(driver.find_element(By.NAME, "especialidade"))
+        try:
+            specialty_select.select_by_visible_text(especialidade)
+        except NoSuchElementException:
+            logger.warning(f"Especialidade não encontrada: {especialidade}")
+
+    if area_atuacao:
+        area_select = Select(driver.find_element(By.NAME, "areaAtuacao"))
+        try:
+            area_select.select_by_visible_text(area_atuacao)
+        except NoSuchElementException:
+            logger.warning(f"Área de Atuação não encontrada: {area_atuacao}")
+
+    if situacao:
+        situation_select = Select(driver.find_element(By.NAME, "tipoSituacao"))
+        situation_value = "A" if situacao == "ATIVO" else "I"
+        situation_select.select_by_value(situation_value)
+
+    # Click search button
+    with metrics.stage("scrape.page_load"):
+        search_button = WebDriverWait(driver, 10).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, "button.w-100.btn-buscar.btnPesquisar"))
+        )
+        driver.execute_script("arguments[0].click();", search_button)
+
+        # Wait for initial loading
+        _wait_loading(driver)
+
+        # Wait for the record counter instead of a fixed sleep
+        total_records_element = WebDriverWait(driver, 30).until(_results_counter_ready)
+
+    # Get total number of records
+    return int(total_records_element.text.split()[0])
+
+
+def _go_to_page(driver, current, target):
+    """
+    Move the pager from `current` to `target`. The pager only shows the
+    pages around the current one, so far pages are reached by clicking the
+    highest visible page number below the target until it shows up
+    """
+    while current < target:
+        WebDriverWait(driver, 10).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, f".paginationjs-page[data-num='{current + 1}']"))
+        )
+        visible = [
+            int(element.get_attribute("data-num"))
+            for element in driver.find_elements(By.CSS_SELECTOR, ".paginationjs-page[data-num]")
+        ]
+        step = max(num for num in visible if current < num <= target)
+        with metrics.stage("scrape.page_load"):
+            link = driver.find_element(By.CSS_SELECTOR, f".paginationjs-page[data-num='{step}']")
+            driver.execute_script("arguments[0].click();", link)
+
+            # Wait for loading
+            _wait_loading(driver)
+            time.sleep(3)
+        current = step
+    return current
+
+
+def count_search_pages(uf, nome="", situacao="ATIVO", especialidade="", area_atuacao=""):
+    """Number of result pages of a search, without reading them"""
+    driver = create_driver()
+    try:
+        return total_pages_for(_open_search(driver, nome, uf, situacao, especialidade, area_atuacao))
+    finally:
+        driver.quit()
+
+
+def iter_search_pages(nome, uf, situacao="ATIVO", especialidade="", area_atuacao="",
+                      should_stop=None, first_page=1, last_page=None, failed_pages=None):
+    """
+    Run a search on the CRM portal and yield (page, total_pages, page_results)
+    as soon as each result page is parsed, so callers can show and process
+    the first doctors while the crawl continues
+
+    should_stop() is checked between pages so a background job can be cancelled.
+    first_page/last_page limit the crawl to a slice of the result pages.
+    Pages that could not be reached are skipped and, when a list is given
+    as failed_pages, appended to it
+    """
+    driver = create_driver()
+
+    # Same doctor may appear on several pages
+    search_dedup = Deduplicator("search")
+
+    try:
+        total_records = _open_search(driver, nome, uf, situacao, especialidade, area_atuacao)
+        total_pages = total_pages_for(total_records)
+
+        logger.info(f"Total de registros: {total_records}, Páginas: {total_pages}")
+
+        end_page = min(total_pages, last_page) if last_page else total_pages
+        current = 1
+
+        # Process each page
+        for page in range(first_page, end_page + 1):
+            if should_stop and should_stop():
+                logger.info(f"Busca interrompida na página {page}")
+                break
+
+            logger.info(f"Processando página {page} de {total_pages}")
+
+            if page > current:
+                try:
+                    current = _go_to_page(driver, current, page)
+                except Exception as e:
+                    logger.error(f"Erro na navegação da página {page}: {str(e)}")
+                    if failed_pages is not None:
+                        failed_pages.append(page)
+                    continue
+
+            # Parse results
+            with metrics.stage("parse") as parse_timing:
+                page_results = parse_doctor_items(driver.page_source, uf)
+                parse_timing.items = len(page_results)
+
+            yield page, total_pages, search_dedup.filter(page_results)
+
+            time.sleep(2)  # Delay between pages
+
+    finally:
+        driver.quit()
+
+
+def results_to_csv(results):
+    """CSV export of the search results: NOME;CIDADE;UF;DT_NASCIMENTO"""
+    lines = ["NOME;CIDADE;UF;DT_NASCIMENTO"]
+    for row in results:
+        lines.append(f"{row['Nome']};{row['Cidade']};{row['UF']};{row['DT_NASCIMENTO']}")
+    return "\n".join(lines) + "\n"
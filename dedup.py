@@ -0,0 +1,270 @@
+"""
+Cross-source deduplication run before every paid or outward call
+(RD Station chat, Lemitti lookup, Tallos create_contact + send_message).
+
+A record is identified by blocking keys:
+- CRM + UF when the CRM number is known;
+- normalized name + phone otherwise;
+- normalized name + city + UF as a last resort, when there is no phone.
+
+A record is a duplicate if any of its keys was already seen. Keys are stored
+as 64-bit hashes in sorted numpy arrays, 8 bytes per key, so even the index
+of a million-row file stays small.
+"""
+import logging
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_NON_ALNUM = re.compile(r"[^A-Z0-9]+")
+_NON_DIGIT = re.compile(r"\D+")
+
+
+def normalize_name(name):
+    """Upper-case, accent-folded name with punctuation removed and spaces collapsed"""
+    if name is None or (isinstance(name, float) and np.isnan(name)):
+        return ""
+    folded = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii")
+    return _NON_ALNUM.sub(" ", folded.upper()).strip()
+
+
+def normalize_phone(ddd, fone=""):
+    """Digits of DDD + number without the 55 country code"""
+    digits = _NON_DIGIT.sub("", f"{cell_text(ddd)}{cell_text(fone)}")
+    if len(digits) > 11 and digits.startswith("55"):
+        digits = digits[2:]
+    return digits
+
+
+def cell_text(value):
+    """Cell value as text: NaN/None become "", whole floats (98.0) lose the decimals"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def record_keys(record):
+    """Blocking keys of a scraped or enriched record (either column naming)"""
+    name = normalize_name(record.get("NOME") or record.get("Nome"))
+    uf = cell_text(record.get("UF")).upper()
+    crm = _NON_DIGIT.sub("", cell_text(record.get("CRM")))
+    phone = normalize_phone(record.get("DDD"), record.get("FONE") or record.get("Telefone"))
+
+    keys = []
+    if crm:
+        keys.append(f"crm:{crm}:{uf}")
+    if name and phone:
+        keys.append(f"np:{name}:{phone}")
+    if name and not crm and not phone:
+        city = normalize_name(record.get("CIDADE") or record.get("Cidade"))
+        keys.append(f"nc:{name}:{city}:{uf}")
+    return keys
+
+
+def _map_unique(series, func):
+    """Apply `func` once per distinct value of `series` instead of once per row"""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    mapped = np.array([func(value) for value in uniques.tolist()], dtype=object)
+    return pd.Series(mapped[codes], index=series.index, dtype=object)
+
+
+def _hash_keys(keys):
+    return pd.util.hash_array(np.asarray(keys, dtype=object), categorize=False)
+
+
+# Hashes kept in a plain set until they are merged into a sorted block
+_PENDING_LIMIT = 4096
+
+
+class _HashIndex:
+    """
+    Set of 64-bit hashes kept as sorted uint64 arrays instead of Python ints
+    (about 8 bytes per key instead of 60). New hashes wait in a small set and
+    go in as a block; blocks of similar size are merged, so a lookup
+    searches O(log n) arrays
+    """
+
+    def __init__(self):
+        self._blocks = []
+        self._pending = set()
+
+    def __len__(self):
+        return sum(len(block) for block in self._blocks) + len(self._pending)
+
+    def __contains__(self, value):
+        if value in self._pending:
+            return True
+        value = np.uint64(value)
+        for block in self._blocks:
+            position = block.searchsorted(value)
+            if position < len(block) and block[position] == value:
+                return True
+        return False
+
+    def contains(self, hashes):
+        """Boolean mask of the uint64 array `hashes` already in the index"""
+        found = np.zeros(len(hashes), dtype=bool)
+        if self._pending:
+            found |= np.fromiter((h in self._pending for h in hashes.tolist()), dtype=bool, count=len(hashes))
+        for block in self._blocks:
+            positions = np.minimum(block.searchsorted(hashes), len(block) - 1)
+            found |= block[positions] == hashes
+        return found
+
+    def update(self, hashes):
+        """Add hashes (ints or a uint64 array) not yet in the index"""
+        if isinstance(hashes, np.ndarray):
+            if len(hashes) >= _PENDING_LIMIT:
+                self._add_block(np.unique(hashes))
+                return
+            hashes = hashes.tolist()
+        self._pending.update(hashes)
+        if len(self._pending) >= _PENDING_LIMIT:
+            block = np.fromiter(self._pending, dtype=np.uint64, count=len(self._pending))
+            self._pending = set()
+            block.sort()
+            self._add_block(block)
+
+    def _add_block(self, block):
+        if not len(block):
+            return
+        self._blocks.append(block)
+        while len(self._blocks) > 1 and len(self._blocks[-2]) <= 2 * len(self._blocks[-1]):
+            # Blocks never share a hash, so a sort is enough to merge them
+            newest = self._blocks.pop()
+            merged = np.concatenate((self._blocks[-1], newest))
+            merged.sort()
+            self._blocks[-1] = merged
+
+
+class Deduplicator:
+    """
+    Hashed index of the entities already sent to a stage
+
+    `calls_per_record` is how many outward calls a record would have cost, so
+    the saving can be reported in API calls
+    """
+
+    def __init__(self, stage, calls_per_record=1):
+        self.stage = stage
+        self.calls_per_record = calls_per_record
+        self._seen = _HashIndex()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _count(self, checked, duplicates):
+        self.checked += checked
+        self.duplicates += duplicates
+        if duplicates:
+            metrics.inc("dedup_saved_calls", duplicates * self.calls_per_record, endpoint=self.stage)
+
+    def is_duplicate(self, record):
+        """Check a single record and remember its keys"""
+        return not self.filter([record])
+
+    def filter(self, records):
+        """Return the records not seen before, in order, and remember their keys"""
+        records = list(records)
+        keyed = [(record, record_keys(record)) for record in records]
+        flat = [key for _, keys in keyed for key in keys]
+        hashes = iter(_hash_keys(flat).tolist()) if flat else iter(())
+
+        unique = []
+        with self._lock:
+            for record, keys in keyed:
+                record_hashes = [next(hashes) for _ in keys]
+                if record_hashes and any(h in self._seen for h in record_hashes):
+                    continue
+                self._seen.update(record_hashes)
+                unique.append(record)
+            self._count(len(records), len(records) - len(unique))
+        return unique
+
+    def filter_dataframe(self, df):
+        """
+        Vectorized version of `filter` for enriched DataFrames (NOME, DDD, FONE,
+        CIDADE, UF and optionally CRM columns)
+        """
+        if df.empty:
+            return df
+
+        def column(name, normalize):
+            if name not in df.columns:
+                return pd.Series("", index=df.index, dtype=object)
+            return _map_unique(df[name], normalize)
+
+        names = column("NOME", normalize_name)
+        city = column("CIDADE", normalize_name)
+        uf = column("UF", lambda value: cell_text(value).upper())
+        crm = column("CRM", lambda value: _NON_DIGIT.sub("", cell_text(value)))
+        if "DDD" in df.columns or "FONE" in df.columns:
+            ddd = column("DDD", cell_text)
+            fone = column("FONE", cell_text)
+            phone = _map_unique(ddd + "|" + fone, lambda value: normalize_phone(*value.split("|", 1)))
+        else:
+            phone = pd.Series("", index=df.index, dtype=object)
+
+        has_crm = crm != ""
+        has_phone = (names != "") & (phone != "")
+        has_city_key = (names != "") & ~has_crm & (phone == "")
+        key_columns = [
+            ("crm:" + crm + ":" + uf).where(has_crm),
+            ("np:" + names + ":" + phone).where(has_phone),
+            ("nc:" + names + ":" + city + ":" + uf).where(has_city_key),
+        ]
+
+        duplicated = np.zeros(len(df), dtype=bool)
+        hashed = []
+        conflicts = np.zeros(len(df), dtype=bool)
+        with self._lock:
+            seen = self._seen
+            for keys in key_columns:
+                present = keys.notna().to_numpy()
+                hashes = pd.util.hash_array(keys.to_numpy(dtype=object)[present], categorize=False)
+                rows = np.flatnonzero(present)
+                if len(seen):
+                    duplicated[rows[seen.contains(hashes)]] = True
+                conflicts[rows[pd.Series(hashes).duplicated(keep=False).to_numpy()]] = True
+                hashed.append((rows, hashes))
+            # Rows sharing a key within the batch are resolved in file order, as
+            # `filter` does: a row only blocks later ones if it was kept itself
+            pending = np.flatnonzero(conflicts & ~duplicated)
+            if len(pending):
+                row_keys = {row: [] for row in pending.tolist()}
+                for rows, hashes in hashed:
+                    selected = np.isin(rows, pending)
+                    for row, key in zip(rows[selected].tolist(), hashes[selected].tolist()):
+                        row_keys[row].append(key)
+                kept = set()
+                for row in pending.tolist():
+                    if any(key in kept for key in row_keys[row]):
+                        duplicated[row] = True
+                    else:
+                        kept.update(row_keys[row])
+            # only rows that survive contribute their keys
+            for rows, hashes in hashed:
+                seen.update(hashes[~duplicated[rows]])
+            self._count(len(df), int(duplicated.sum()))
+        return df[~duplicated]
+
+    def report(self):
+        return {
+            "stage": self.stage,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "saved_calls": self.duplicates * self.calls_per_record,
+            "index_size": len(self._seen),
+        }
@@ -0,0 +1,183 @@
+"""
+Offline enrichment from a local Lemit export (same columns as the enriched
+CSV: NOME, CPF/CNPJ, DDD, FONE, EMAIL-1, CIDADE, UF, CEP, FULL-LOGRADOURO).
+
+The export is indexed once per file version into a directory:
+
+    rows.sqlite3             every export row as JSON, keyed by row number
+    *.npy, name_index.json   the matching.NameIndex of NOME/CIDADE/UF
+    meta.json                size and mtime of the export it was built from
+
+Opening an index memory-maps the NameIndex arrays, so even a multi-million
+row export costs little RAM. Scraped doctors are then matched in bulk by
+name, city and UF and only the matched rows are read back from SQLite; the
+Lemitti API is left for the doctors the export does not have.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from campaign_stream import iter_csv_chunks
+from dedup import normalize_phone
+from matching import CONTACT_COLUMNS, MIN_SCORE, NameIndex
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_EXPORT_PATH = os.environ.get("ENRICHMENT_EXPORT_PATH", "")
+ENRICHMENT_INDEX_DIR = os.environ.get("ENRICHMENT_INDEX_DIR", "enrichment_index")
+
+# Row ids per SELECT, below SQLite's bound-parameter limit
+FETCH_BATCH = 900
+
+_open_indexes = {}
+_build_locks = {}
+_open_lock = threading.Lock()
+
+
+def _source_meta(export_path):
+    stat = os.stat(export_path)
+    return {"source": os.path.abspath(export_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def index_directory(export_path, root=ENRICHMENT_INDEX_DIR):
+    """Directory of the index of one export file under `root`"""
+    digest = hashlib.sha1(os.path.abspath(export_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(root, digest)
+
+
+class EnrichmentIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.names = NameIndex.load(directory)
+        self.db_path = os.path.join(directory, "rows.sqlite3")
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    @classmethod
+    def build(cls, export_path, directory, chunksize=50_000, on_progress=None):
+        """
+        Index the export into `directory`. The files are written to a
+        temporary directory that replaces the old index only when complete
+        """
+        meta = _source_meta(export_path)
+        building = directory + ".building"
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+
+        names, cities, ufs = [], [], []
+        conn = sqlite3.connect(os.path.join(building, "rows.sqlite3"))
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE rows (id INTEGER PRIMARY KEY, record TEXT NOT NULL)")
+            for chunk in iter_csv_chunks(export_path, chunksize):
+                if "NOME" not in chunk.columns:
+                    raise ValueError("Coluna obrigatória ausente no export: NOME")
+                start = len(names)
+                conn.executemany(
+                    "INSERT INTO rows (id, record) VALUES (?, ?)",
+                    ((start + offset, json.dumps(record, ensure_ascii=False))
+                     for offset, record in enumerate(chunk.to_dict("records"))),
+                )
+                names.extend(chunk["NOME"].tolist())
+                cities.extend(chunk["CIDADE"].tolist() if "CIDADE" in chunk.columns else [""] * len(chunk))
+                ufs.extend(chunk["UF"].tolist() if "UF" in chunk.columns else [""] * len(chunk))
+                if on_progress:
+                    on_progress(len(names))
+            conn.commit()
+        finally:
+            conn.close()
+
+        NameIndex(names, cities, ufs).save(building)
+        with open(os.path.join(building, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**meta, "rows": len(names), "built_at": time.time()}, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(building, directory)
+        logger.info("Export %s indexado: %d linhas em %s", export_path, len(names), directory)
+        return cls(directory)
+
+    @staticmethod
+    def is_current(export_path, directory):
+        """True if `directory` holds an index of the export as it is now"""
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        current = _source_meta(export_path)
+        return all(meta.get(key) == value for key, value in current.items())
+
+    def rows(self, ids):
+        """Export rows by row number, as {id: record}"""
+        ids = [int(row_id) for row_id in ids]
+        found = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for start in range(0, len(ids), FETCH_BATCH):
+                batch = ids[start:start + FETCH_BATCH]
+                placeholders = ", ".join("?" * len(batch))
+                for row_id, record in conn.execute(
+                    f"SELECT id, record FROM rows WHERE id IN ({placeholders})", batch
+                ):
+                    found[row_id] = json.loads(record)
+        finally:
+            conn.close()
+        return found
+
+    def enrich(self, records, min_score=MIN_SCORE):
+        """
+        Contact for each scraped record (Nome/Cidade/UF), aligned with
+        `records`, or None: the CONTACT_COLUMNS of the matched export row plus
+        Telefone, Endereço and Similaridade, as LemittiAPI.search_doctor
+        returns them
+        """
+        if not records:
+            return []
+        matches = self.names.match_records(pd.DataFrame(records), min_score=min_score)
+        matched_rows = matches["row"].to_numpy()
+        rows = self.rows(set(matched_rows[matched_rows >= 0].tolist()))
+
+        contacts = []
+        for row_id, score in zip(matched_rows.tolist(), matches["score"].tolist()):
+            if row_id < 0:
+                contacts.append(None)
+                continue
+            row = rows[row_id]
+            contacts.append({
+                **{column: row.get(column, "") for column in CONTACT_COLUMNS},
+                "Telefone": normalize_phone(row.get("DDD"), row.get("FONE")) or "Não disponível",
+                "Endereço": row.get("FULL-LOGRADOURO") or "Não disponível",
+                "Similaridade": score,
+            })
+        return contacts
+
+
+def open_index(export_path, root=ENRICHMENT_INDEX_DIR, on_progress=None):
+    """
+    Process-wide EnrichmentIndex of an export, built on first use and again
+    whenever the file changes; concurrent jobs share one build. Builds take
+    a lock of their own directory only, so other exports are not held up
+    """
+    directory = index_directory(export_path, root)
+    with _open_lock:
+        build_lock = _build_locks.setdefault(directory, threading.Lock())
+    with build_lock:
+        index = _open_indexes.get(directory)
+        if index is None or not EnrichmentIndex.is_current(export_path, directory):
+            if EnrichmentIndex.is_current(export_path, directory):
+                index = EnrichmentIndex(directory)
+            else:
+                index = EnrichmentIndex.build(export_path, directory, on_progress=on_progress)
+            with _open_lock:
+                _open_indexes[directory] = index
+        return index
@@ -0,0 +1,322 @@
+"""
+Outbound traffic governor shared by the Lemitti, RD Station and Tallos clients.
+
+Every request goes through a per-host policy made of:
+- a token bucket whose rate is tuned with AIMD (additive increase on success,
+  multiplicative decrease on 429 or latency growth);
+- an AIMD concurrency limit for callers that fan out over threads;
+- a circuit breaker that pauses the stage while the upstream is failing,
+  instead of burning through the remaining rows.
+"""
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeout applied when the caller does not pass one
+DEFAULT_TIMEOUT = (5, 30)
+
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised when a host's circuit stays open longer than the allowed pause"""
+
+
+@dataclass
+class HostPolicy:
+    initial_rate: float = 5.0        # requests/s the bucket starts at
+    min_rate: float = 0.5
+    max_rate: float = 50.0
+    rate_increase: float = 0.5       # minimum additive increase per successful window
+    increase_window: int = 10        # successes needed before the rate grows
+    decrease_factor: float = 0.5     # multiplicative decrease on throttling
+    decrease_cooldown: float = 1.0   # at most one decrease per cooldown, like once per RTT
+    burst: int = 5
+    max_concurrency: int = 16
+    latency_factor: float = 3.0      # latency above baseline * factor counts as congestion
+    failure_threshold: int = 5       # consecutive failures that open the circuit
+    reset_timeout: float = 30.0      # seconds before a half-open probe
+    max_pause: float = 120.0         # longest a caller waits on an open circuit
+    max_retries: int = 3
+    backoff_base: float = 1.0
+
+
+# Provider-specific starting points; anything else uses HostPolicy()
+DEFAULT_POLICIES = {
+    "api.lemit.com.br": HostPolicy(initial_rate=5.0, max_rate=20.0),
+    "api.rd.services": HostPolicy(initial_rate=5.0, max_rate=20.0),
+    "api.tallos.com.br": HostPolicy(initial_rate=10.0, max_rate=80.0, max_concurrency=32),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available; returns the time spent waiting"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AIMDLimiter:
+    """Concurrency limit that grows by one per window of successes and halves on congestion"""
+
+    def __init__(self, max_limit, decrease_factor=0.5):
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.limit = max(1, max_limit // 4)
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, congested=False):
+        with self._cond:
+            self._in_flight -= 1
+            if congested:
+                self.limit = max(1, self.limit * self.decrease_factor)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return 0 if a request may go now, otherwise the seconds to wait before asking again"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if not self._probing:
+                    self._probing = True
+                    return 0
+                return 0.5
+            return remaining
+
+    def record(self, success):
+        with self._lock:
+            self._probing = False
+            if success:
+                self._failures = 0
+                self.state = self.CLOSED
+                return
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuito aberto após %s falhas consecutivas", self._failures)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class HostGovernor:
+    def __init__(self, host, policy):
+        self.host = host
+        self.policy = policy
+        self.bucket = TokenBucket(policy.initial_rate, policy.burst)
+        self.limiter = AIMDLimiter(policy.max_concurrency, policy.decrease_factor)
+        self.breaker = CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+        self._latency = None
+        self._baseline = None
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def wait_for_circuit(self, max_pause=None):
+        max_pause = self.policy.max_pause if max_pause is None else max_pause
+        paused = 0.0
+        while True:
+            delay = self.breaker.allow()
+            if delay <= 0:
+                return
+            if paused + delay > max_pause:
+                metrics.inc("governor_circuit_rejected", endpoint=self.host)
+                raise CircuitOpenError(f"Circuito aberto para {self.host}")
+            time.sleep(delay)
+            paused += delay
+
+    def observe(self, seconds, status):
+        """Feed the outcome of a request back into the rate and circuit state; returns True if congested"""
+        policy = self.policy
+        throttled = status == 429
+        failed = status is None or status >= 500
+        with self._lock:
+            self._latency = seconds if self._latency is None else 0.8 * self._latency + 0.2 * seconds
+            if self._baseline is None or self._latency < self._baseline:
+                self._baseline = self._latency
+            slow = self._latency > self._baseline * policy.latency_factor and self._latency > 0.05
+            congested = throttled or slow
+            now = time.monotonic()
+            if congested:
+                self._successes = 0
+                if now - self._last_decrease >= policy.decrease_cooldown:
+                    self.bucket.rate = max(policy.min_rate, self.bucket.rate * policy.decrease_factor)
+                    self._last_decrease = now
+                    metrics.inc("governor_rate_decreases", endpoint=self.host)
+                # let the baseline drift up so a permanently slower upstream is not punished forever
+                self._baseline = (self._baseline + self._latency) / 2
+            elif not failed:
+                self._successes += 1
+                if self._successes >= policy.increase_window:
+                    step = max(policy.rate_increase, self.bucket.rate * 0.1)
+                    self.bucket.rate = min(policy.max_rate, self.bucket.rate + step)
+                    self._successes = 0
+        self.breaker.record(not failed and not throttled)
+        return congested
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "rate": round(self.bucket.rate, 2),
+            "concurrency": int(self.limiter.limit),
+            "circuit": self.breaker.state,
+            "latency_ewma": round(self._latency, 4) if self._latency is not None else None,
+        }
+
+
+class OutboundGovernor:
+    def __init__(self, policies=None):
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def host(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            governor = self._hosts.get(host)
+            if governor is None:
+                policy = self.policies.get(host) or self.policies.get(host.split(":")[0]) or HostPolicy()
+                governor = self._hosts[host] = HostGovernor(host, policy)
+            return governor
+
+    def session(self):
+        """Per-thread session so connections are reused between calls"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, method, url, max_pause=None, endpoint=None, **kwargs):
+        """
+        Send a request through the host's rate limit, concurrency limit and
+        circuit breaker, retrying 429s (and 5xx/connection errors for GET)
+        with exponential backoff. Returns the last response
+
+        max_pause overrides how long an open circuit may hold the caller;
+        interactive calls pass 0 to fail fast instead of pausing. Each
+        attempt is timed under `endpoint` (host and method by default), so
+        the latency percentiles leave out the throttling and backoff waits,
+        which are counted apart
+        """
+        governor = self.host(url)
+        policy = governor.policy
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        idempotent = method.upper() in ("GET", "HEAD", "OPTIONS")
+        endpoint = endpoint or f"{governor.host} {method.upper()}"
+
+        for attempt in range(policy.max_retries + 1):
+            governor.wait_for_circuit(max_pause)
+            waited = governor.bucket.acquire()
+            if waited:
+                metrics.inc("governor_throttle_wait_ms", int(waited * 1000), endpoint=governor.host)
+            governor.limiter.acquire()
+            started = time.perf_counter()
+            status = None
+            last_attempt = attempt >= policy.max_retries
+            try:
+                with metrics.request(endpoint) as req:
+                    try:
+                        response = self.session().request(method, url, **kwargs)
+                    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                        req.retried = idempotent and not last_attempt
+                        raise
+                    req.status = status = response.status_code
+                    req.retried = not last_attempt and (
+                        status == 429 or (idempotent and status in RETRYABLE_STATUS))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                congested = governor.observe(time.perf_counter() - started, None)
+                governor.limiter.release(congested)
+                if last_attempt or not idempotent:
+                    raise
+                metrics.inc("governor_retries", endpoint=governor.host)
+                self._backoff(governor, attempt, None)
+                continue
+            except Exception:
+                governor.breaker.record(False)
+                governor.limiter.release(False)
+                raise
+
+            congested = governor.observe(time.perf_counter() - started, status)
+            governor.limiter.release(congested)
+
+            if not req.retried:
+                return response
+            metrics.inc("governor_retries", endpoint=governor.host)
+            self._backoff(governor, attempt, response.headers.get("Retry-After"))
+        return response
+
+    def _backoff(self, governor, attempt, retry_after):
+        policy = governor.policy
+        delay = policy.backoff_base * (2 ** attempt) * (0.5 + random.random() / 2)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        metrics.inc("governor_backoff_wait_ms", int(delay * 1000), endpoint=governor.host)
+        time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return [governor.stats() for governor in self._hosts.values()]
+
+
+# Shared instance used by all API clients
+governor = OutboundGovernor()
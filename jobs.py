@@ -0,0 +1,301 @@
+"""
+Background job runner for scrape, enrich and send work.
+
+Jobs run on a thread pool owned by the Streamlit server process, so they keep
+going when the browser is refreshed or the script reruns, and several users
+can share the app. Status, progress and partial results live in a SQLite job
+table that any session can poll.
+"""
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import traceback
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "jobs.sqlite3")
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED, INTERRUPTED = (
+    "pending", "running", "done", "failed", "cancelled", "interrupted"
+)
+FINISHED = (DONE, FAILED, CANCELLED, INTERRUPTED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT,
+    status TEXT NOT NULL,
+    progress INTEGER DEFAULT 0,
+    total INTEGER DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    created_at TEXT,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    search TEXT,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled"""
+
+
+class JobContext:
+    """Handle passed to the job function to report progress and partial results"""
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+        self._seq = 0
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+    def set_progress(self, done, total=None, message=None):
+        self.runner._update(self.job_id, progress=done, total=total, message=message)
+
+    def add_results(self, records):
+        """Append partial results that the UI can show before the job ends"""
+        records = list(records)
+        if not records:
+            return
+        rows = []
+        for record in records:
+            rows.append((self.job_id, self._seq, json.dumps(record, ensure_ascii=False, default=str),
+                         _search_text(record)))
+            self._seq += 1
+        self.runner._insert_results(rows)
+
+
+class JobRunner:
+    def __init__(self, db_path=JOBS_DB_PATH, max_workers=4):
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._contexts = {}
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+            # Jobs left running by a previous server process cannot be resumed
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE status IN (?, ?)",
+                (INTERRUPTED, _now(), PENDING, RUNNING),
+            )
+
+    @staticmethod
+    def _migrate(conn):
+        # Tables created before the search column: add it and fill it in
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(job_results)")}
+        if "search" not in columns:
+            conn.execute("ALTER TABLE job_results ADD COLUMN search TEXT")
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, record FROM job_results WHERE search IS NULL LIMIT 5000"
+            ).fetchall()
+            if not rows:
+                return
+            conn.executemany(
+                "UPDATE job_results SET search = ? WHERE rowid = ?",
+                [(_search_text(json.loads(row["record"])), row["rowid"]) for row in rows],
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _update(self, job_id, **fields):
+        fields = {key: value for key, value in fields.items() if value is not None}
+        if not fields:
+            return
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _insert_results(self, rows):
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT INTO job_results (job_id, seq, record, search) VALUES (?, ?, ?, ?)", rows)
+
+    def submit(self, kind, func, on_finish=None, **params):
+        """
+        Queue func(job, **params) and return the job id. Scalar params are
+        also stored in the job table for display. on_finish() is called once
+        the job is over, including when it is cancelled before it starts
+        """
+        job_id = uuid.uuid4().hex[:12]
+        stored = json.dumps({k: v for k, v in params.items() if _is_plain(v)}, ensure_ascii=False, default=str)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, stored, PENDING, _now()),
+            )
+        context = JobContext(self, job_id)
+        self._contexts[job_id] = context
+        self._executor.submit(self._run, context, func, params, on_finish)
+        logger.info("Job %s (%s) enfileirado", job_id, kind)
+        return job_id
+
+    def _run(self, context, func, params, on_finish=None):
+        job_id = context.job_id
+        try:
+            if context.cancelled:
+                self._update(job_id, status=CANCELLED, finished_at=_now())
+                return
+            self._update(job_id, status=RUNNING, started_at=_now())
+            result = func(context, **params)
+            status = CANCELLED if context.cancelled else DONE
+            self._update(job_id, status=status, finished_at=_now(),
+                         result=json.dumps(result, ensure_ascii=False, default=str))
+        except JobCancelled:
+            self._update(job_id, status=CANCELLED, finished_at=_now())
+        except Exception as e:
+            logger.error("Job %s falhou: %s", job_id, e)
+            self._update(job_id, status=FAILED, finished_at=_now(),
+                         error=f"{e}\n{traceback.format_exc()}")
+        finally:
+            self._contexts.pop(job_id, None)
+            if on_finish:
+                try:
+                    on_finish()
+                except Exception:
+                    logger.exception("Falha ao finalizar o job %s", job_id)
+
+    def cancel(self, job_id):
+        context = self._contexts.get(job_id)
+        if context:
+            context._cancel.set()
+            return True
+        return False
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job_dict(row) if row else None
+
+    def list_jobs(self, limit=20, kind=None):
+        query = "SELECT * FROM jobs"
+        args = []
+        if kind:
+            query += " WHERE kind = ?"
+            args.append(kind)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._connect() as conn:
+            return [_job_dict(row) for row in conn.execute(query, args)]
+
+    def results(self, job_id, offset=0, limit=None):
+        """Partial (or final) records of a job, in the order they were produced"""
+        query = "SELECT record FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq"
+        args = [job_id, offset]
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self._connect() as conn:
+            return [json.loads(row["record"]) for row in conn.execute(query, args)]
+
+    def result_count(self, job_id, search=None):
+        """Number of records of a job, optionally only those containing `search`"""
+        where, args = _result_filter(job_id, search)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM job_results WHERE {where}", args).fetchone()[0]
+
+    def query_results(self, job_id, search=None, sort_by=None, descending=False, offset=0, limit=50):
+        """
+        One page of a job's records, filtered and sorted by SQLite so only the
+        visible slice is decoded and sent to the browser
+        """
+        where, args = _result_filter(job_id, search)
+        order, order_args = "seq", []
+        if sort_by:
+            order = f"json_extract(record, ?) {'DESC' if descending else 'ASC'}, seq"
+            order_args.append(_json_path(sort_by))
+        query = f"SELECT record FROM job_results WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?"
+        with self._connect() as conn:
+            rows = conn.execute(query, [*args, *order_args, limit, offset])
+            return [json.loads(row["record"]) for row in rows]
+
+    def result_columns(self, job_id, sample=200):
+        """Field names of a job's records, in order of appearance in the first `sample` ones"""
+        columns = {}
+        for record in self.results(job_id, limit=sample):
+            columns.update(dict.fromkeys(record))
+        return list(columns)
+
+    def result_value_counts(self, job_id, column, limit=20):
+        """(value, count) of a record field, most frequent first, aggregated in SQLite"""
+        query = (
+            "SELECT json_extract(record, ?) AS value, COUNT(*) AS total FROM job_results "
+            "WHERE job_id = ? GROUP BY value ORDER BY total DESC LIMIT ?"
+        )
+        with self._connect() as conn:
+            return [tuple(row) for row in conn.execute(query, (_json_path(column), job_id, limit))]
+
+
+def _json_path(column):
+    return '$."' + column.replace('"', '\\"') + '"'
+
+
+def _fold(text):
+    """Case- and accent-insensitive form of `text`, so "joão" finds "JOÃO" """
+    decomposed = unicodedata.normalize("NFKD", str(text).casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _search_text(record):
+    # Only the values, one per line, so field names never match a search
+    return "\n".join(_fold(value) for value in record.values() if value is not None)
+
+
+def _result_filter(job_id, search):
+    # Substring of any field value, with the user's % and _ taken literally
+    if search:
+        pattern = _fold(search).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return "job_id = ? AND search LIKE ? ESCAPE '\\'", [job_id, f"%{pattern}%"]
+    return "job_id = ?", [job_id]
+
+
+def _is_plain(value):
+    return isinstance(value, (str, int, float, bool, type(None)))
+
+
+def _job_dict(row):
+    job = dict(row)
+    for key in ("params", "result"):
+        if job.get(key):
+            try:
+                job[key] = json.loads(job[key])
+            except ValueError:
+                pass
+    return job
@@ -0,0 +1,131 @@
+import requests
+import json
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+from metrics import metrics
+from profiling import profiler
+from governor import governor
+from log_utils import LazyPayload, log_sampled, truncate
+from dedup import normalize_name
+from matching import lemitti_candidates, pick_contact
+
+logger = logging.getLogger(__name__)
+
+# Names whose candidates are kept, least recently used dropped first
+CACHE_SIZE = 10_000
+
+class LemittiAPI:
+    def __init__(self, token, base_url="https://api.lemit.com.br"):
+        self.base_url = base_url
+        self.headers = {
+            'Authorization': f'Bearer {token}'
+        }
+        # Candidates by normalized name, so repeated doctors cost a single lookup;
+        # only answers that came back with HTTP 200 are kept
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _consulta(self, kind, nome):
+        """
+        POST a name lookup to /api/v1/consulta/<kind>/ and return the people
+        found, or None when the lookup failed (non-200 or invalid JSON)
+        """
+        response = governor.request(
+            "POST",
+            f"{self.base_url}/api/v1/consulta/{kind}/",
+            headers=self.headers,
+            json={'nome': nome},
+            endpoint=f"lemitti POST /consulta/{kind}"
+        )
+
+        # Log response details
+        logger.debug("%s status code: %s", kind, response.status_code)
+        logger.debug("%s response headers: %s", kind, LazyPayload(response.headers))
+
+        if response.status_code == 200:
+            try:
+                data = response.json()
+            except json.JSONDecodeError as e:
+                logger.error(f"Erro ao decodificar JSON: {str(e)}")
+                logger.error("Conteúdo que causou erro: %s", truncate(response.text))
+                return None
+            logger.debug("%s parsed data: %s", kind, LazyPayload(data))
+
+            candidates = lemitti_candidates(data)
+            if not candidates:
+                logger.debug("Nenhum telefone ou endereço encontrado nos dados (%s)", kind)
+            return candidates
+
+        logger.error("Erro na requisição %s: %s", kind, response.status_code)
+        logger.error("Erro detalhado %s: %s", kind, truncate(response.text))
+        return None
+
+    def _cached(self, key):
+        with self._cache_lock:
+            candidates = self._cache.get(key)
+            if candidates is not None:
+                self._cache.move_to_end(key)
+            return candidates
+
+    def _remember(self, key, candidates):
+        with self._cache_lock:
+            self._cache[key] = candidates
+            self._cache.move_to_end(key)
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    @profiler.profiled("lemitti")
+    @metrics.timed("lemitti")
+    def search_doctor(self, nome_medico, record=None):
+        """
+        Search for additional contact information, trying the pessoa endpoint
+        first and falling back to empresa
+
+        The people returned are scored against the CRM record (name, city,
+        UF; just the name without a record) and only the best match is used,
+        with its phone and address in the record's UF/city when it has several.
+        Returns the contact from pick_contact (the enriched CSV columns plus
+        Telefone, Endereço and Similaridade) or None if no one matches
+        """
+        record = record or {"Nome": nome_medico}
+        cache_key = normalize_name(nome_medico)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            metrics.inc("dedup_saved_calls", endpoint="lemitti")
+            return self._match(record, cached)
+
+        try:
+            log_sampled(logger, logging.INFO, "lemitti.request",
+                        "Fazendo requisição para pessoa endpoint com nome: %s", nome_medico)
+            pessoas = self._consulta("pessoa", nome_medico)
+            candidates = pessoas or []
+            contact = pick_contact(record, candidates)
+            complete = pessoas is not None
+            if not contact:
+                logger.debug("Tentando empresa endpoint para: %s", nome_medico)
+                empresas = self._consulta("empresa", nome_medico)
+                complete = complete and empresas is not None
+                candidates = candidates + (empresas or [])
+                contact = self._match(record, candidates)
+            # A failed lookup (429, 5xx, bad JSON) is retried next time instead of
+            # turning into a permanent "not found"
+            if complete:
+                self._remember(cache_key, candidates)
+            return contact
+
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Erro de conexão: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"Erro inesperado ao consultar API Lemitti: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return None
+
+    @staticmethod
+    def _match(record, candidates):
+        contact = pick_contact(record, candidates)
+        if candidates and not contact:
+            metrics.inc("lemitti_rejected_matches")
+        return contact
@@ -0,0 +1,115 @@
+import itertools
+import json
+import logging
+import os
+import threading
+
+# Keys whose values must never reach the logs
+SECRET_KEYS = {"authorization", "token", "api_key", "apikey", "password", "secret", "cpf/cnpj"}
+
+# Maximum number of characters of a payload written to the logs
+PAYLOAD_LIMIT = int(os.environ.get("LOG_PAYLOAD_LIMIT", "2000"))
+
+
+def redact(data):
+    """Return a copy of `data` with secret values masked"""
+    if isinstance(data, dict) or hasattr(data, "items"):
+        return {
+            key: "***" if str(key).lower() in SECRET_KEYS else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [redact(value) for value in data]
+    return data
+
+
+def truncate(text, limit=None):
+    """Cap `text` to `limit` characters, noting how much was dropped"""
+    limit = PAYLOAD_LIMIT if limit is None else limit
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} caracteres omitidos]"
+
+
+class LazyPayload:
+    """
+    Defers redaction and serialization of a payload until a handler actually
+    formats the record, so disabled DEBUG calls cost only the object creation
+    """
+
+    __slots__ = ("data", "limit")
+
+    def __init__(self, data, limit=None):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self):
+        data = self.data
+        if callable(data):
+            data = data()
+        try:
+            text = json.dumps(redact(data), ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            text = str(data)
+        return truncate(text, self.limit)
+
+
+class Sampler:
+    """Lets through one event out of every `every` per key"""
+
+    def __init__(self, every=100):
+        self.every = max(1, every)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def should_log(self, key):
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = itertools.count()
+            return next(counter) % self.every == 0
+
+
+sampler = Sampler(int(os.environ.get("LOG_SAMPLE_EVERY", "100")))
+
+
+def log_sampled(logger, level, key, msg, *args):
+    """Log a high-volume event only for a sample of its occurrences"""
+    if logger.isEnabledFor(level) and sampler.should_log(key):
+        logger.log(level, msg, *args)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for shipping logs to a collector"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level=None, structured=None):
+    """
+    Configure the root logger. Level and format come from LOG_LEVEL and
+    LOG_FORMAT ("json" enables structured output) unless given explicitly
+    """
+    level = level or os.environ.get("LOG_LEVEL", "INFO")
+    if structured is None:
+        structured = os.environ.get("LOG_FORMAT", "").lower() == "json"
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler())
+    for handler in root.handlers:
+        if structured:
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
@@ -0,0 +1,461 @@
+"""
+Fuzzy matching of people by name, city and UF.
+
+Names are compared by their character trigrams (accent-folded, particles
+such as DA/DOS dropped), each name reduced to a 512-bit signature so the
+Dice similarity of many pairs is a few numpy operations:
+
+    dice = 2 * |A & B| / (|A| + |B|)
+
+NameIndex keeps the signatures of a whole enrichment export plus an
+inverted index of trigrams. A query is only scored against the rows
+sharing its rarest trigrams (blocking), so reconciling 100k doctors never
+compares every pair.
+
+pick_contact applies the same score to the candidates of a Lemitti
+response, to take the phone and address of the right person.
+"""
+import json
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from dedup import cell_text, normalize_name, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+PARTICLES = frozenset({"DA", "DE", "DO", "DAS", "DOS", "E"})
+
+# 512-bit signatures; a name has ~20 trigrams, so collisions barely move the score
+SIGNATURE_WORDS = 8
+SIGNATURE_BITS = 64 * SIGNATURE_WORDS
+
+# Weights of the final score; a known UF that differs rules the candidate out
+NAME_WEIGHT = 0.75
+CITY_WEIGHT = 0.15
+UF_WEIGHT = 0.10
+
+MIN_SCORE = 0.8
+
+# Blocking: the rarest trigrams of each query name, skipping the ones so
+# common that their posting list would pull in a large part of the index;
+# a candidate has to share two of them
+BLOCK_TRIGRAMS = 3
+MAX_POSTINGS = 500
+
+DDDS_BY_UF = {
+    "AC": ("68",), "AL": ("82",), "AP": ("96",), "AM": ("92", "97"),
+    "BA": ("71", "73", "74", "75", "77"), "CE": ("85", "88"), "DF": ("61",),
+    "ES": ("27", "28"), "GO": ("62", "64"), "MA": ("98", "99"), "MT": ("65", "66"),
+    "MS": ("67",), "MG": ("31", "32", "33", "34", "35", "37", "38"),
+    "PA": ("91", "93", "94"), "PB": ("83",), "PR": ("41", "42", "43", "44", "45", "46"),
+    "PE": ("81", "87"), "PI": ("86", "89"), "RJ": ("21", "22", "24"), "RN": ("84",),
+    "RS": ("51", "53", "54", "55"), "RO": ("69",), "RR": ("95",), "SC": ("47", "48", "49"),
+    "SP": ("11", "12", "13", "14", "15", "16", "17", "18", "19"), "SE": ("79",), "TO": ("63",),
+}
+
+_CITY_UF = re.compile(r"([^-/,]+)/\s*([A-Z]{2})\s*$")
+_CEP = re.compile(r"\b\d{5}-?\d{3}\b")
+
+# Columns of the enriched CSV a matched contact carries, whatever its source
+CONTACT_COLUMNS = ["NOME", "CPF/CNPJ", "DDD", "FONE", "EMAIL-1", "CIDADE", "UF", "CEP", "FULL-LOGRADOURO"]
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+else:  # numpy < 2.0
+    def _popcount(words):
+        bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=-1)
+        return bits.sum(axis=-1, dtype=np.int64)
+
+
+def name_tokens(name):
+    """Accent-folded words of a name, without particles"""
+    return [token for token in normalize_name(name).split() if token not in PARTICLES]
+
+
+def name_trigrams(name):
+    """Trigrams of each word padded with spaces, so short words and word edges count"""
+    trigrams = set()
+    for token in name_tokens(name):
+        padded = f" {token} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def _flat_trigrams(names):
+    """(trigram array, owner array) over every name, each distinct name processed once"""
+    codes, uniques = pd.factorize(pd.Series(names, dtype=object).fillna(""), use_na_sentinel=False)
+    per_unique = [sorted(name_trigrams(name)) for name in uniques.tolist()]
+    lengths = np.array([len(trigrams) for trigrams in per_unique], dtype=np.int64)[codes]
+    flat = np.array([trigram for trigrams in per_unique for trigram in trigrams], dtype=object)
+    # Offsets of each unique name's trigrams in `flat`, repeated per row
+    starts = np.concatenate(([0], np.cumsum([len(trigrams) for trigrams in per_unique])))[codes]
+    owner = np.repeat(np.arange(len(codes)), lengths)
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return flat[positions] if len(flat) else flat, owner
+
+
+def trigram_signatures(names):
+    """(len(names), SIGNATURE_WORDS) uint64 array with one bit set per hashed trigram"""
+    return _signatures(*_flat_trigrams(names), len(names))
+
+
+def _signatures(trigrams, owner, count):
+    signatures = np.zeros((count, SIGNATURE_WORDS), dtype=np.uint64)
+    if len(trigrams):
+        bits = pd.util.hash_array(trigrams, categorize=False) % np.uint64(SIGNATURE_BITS)
+        np.bitwise_or.at(signatures, (owner, (bits // np.uint64(64)).astype(np.intp)),
+                         np.left_shift(np.uint64(1), bits % np.uint64(64)))
+    return signatures
+
+
+def name_similarity(name_a, name_b):
+    """Exact trigram Dice similarity of two names, for a handful of pairs"""
+    trigrams_a, trigrams_b = name_trigrams(name_a), name_trigrams(name_b)
+    total = len(trigrams_a) + len(trigrams_b)
+    return 2.0 * len(trigrams_a & trigrams_b) / total if total else 0.0
+
+
+def dice(signatures_a, signatures_b):
+    """Trigram Dice similarity of aligned rows of two signature arrays"""
+    shared = _popcount(signatures_a & signatures_b)
+    total = _popcount(signatures_a) + _popcount(signatures_b)
+    return np.divide(2.0 * shared, total, out=np.zeros(len(shared)), where=total > 0)
+
+
+def _normalized(values, normalize):
+    """Array of normalized texts, normalizing each distinct value once"""
+    series = pd.Series(values, dtype=object).fillna("")
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return np.array([normalize(value) for value in uniques.tolist()], dtype=object)[codes]
+
+
+def _uf(value):
+    return cell_text(value).upper()
+
+
+def _field_score(left, right, unknown):
+    """1 when both sides are known and equal, 0 when known and different, 0.5 when unknown"""
+    known = (left != unknown) & (right != unknown)
+    return np.where(known, (left == right).astype(float), 0.5)
+
+
+def match_score(name_similarity, cities_a, cities_b, ufs_a, ufs_b, unknown=""):
+    """
+    Final score of aligned candidate pairs; pairs with different known UFs
+    score 0. Places are normalized texts, or codes with `unknown` for blanks
+    """
+    score = (NAME_WEIGHT * name_similarity
+             + CITY_WEIGHT * _field_score(cities_a, cities_b, unknown)
+             + UF_WEIGHT * _field_score(ufs_a, ufs_b, unknown))
+    different_uf = (ufs_a != unknown) & (ufs_b != unknown) & (ufs_a != ufs_b)
+    return np.where(different_uf, 0.0, score)
+
+
+def _place_codes(values, normalize):
+    """(int32 codes, categories) of normalized places, blank ones coded -1"""
+    codes, categories = pd.factorize(_normalized(values, normalize))
+    codes = codes.astype(np.int32)
+    categories = pd.Index(categories, dtype=object)
+    if "" in categories:
+        codes[codes == categories.get_loc("")] = -1
+    return codes, categories
+
+
+def _query_codes(categories, normalized):
+    """Codes of query places in the index categories; places the index lacks never match"""
+    codes = categories.get_indexer(normalized).astype(np.int32)
+    codes[codes == -1] = len(categories)
+    codes[normalized == ""] = -1
+    return codes
+
+
+class NameIndex:
+    """
+    Trigram index over the people of an enrichment export. Everything is
+    kept in flat numpy arrays, so save() writes .npy files that load()
+    memory-maps instead of reading them into RAM
+    """
+
+    ARRAYS = ("signatures", "city_codes", "uf_codes", "frequency", "postings", "offsets")
+
+    def __init__(self, names, cities=None, ufs=None, max_postings=MAX_POSTINGS):
+        count = len(names)
+        self.max_postings = max_postings
+        trigrams, owner = _flat_trigrams(names)
+        self.signatures = _signatures(trigrams, owner, count)
+        self.city_codes, self.cities = _place_codes(cities if cities is not None else [""] * count,
+                                                    normalize_name)
+        self.uf_codes, self.ufs = _place_codes(ufs if ufs is not None else [""] * count, _uf)
+
+        codes, vocabulary = pd.factorize(trigrams)
+        self.vocabulary = pd.Index(vocabulary, dtype=object)
+        self.frequency = np.bincount(codes, minlength=len(vocabulary))
+        order = np.argsort(codes, kind="stable")
+        self.postings = owner[order]
+        self.offsets = np.concatenate(([0], np.cumsum(self.frequency)))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "name_index.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "max_postings": self.max_postings,
+                "vocabulary": self.vocabulary.tolist(),
+                "cities": self.cities.tolist(),
+                "ufs": self.ufs.tolist(),
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Index written by save(); with mmap the arrays stay on disk and are paged in on use"""
+        index = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(index, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None))
+        with open(os.path.join(directory, "name_index.json"), encoding="utf-8") as f:
+            saved = json.load(f)
+        index.max_postings = saved["max_postings"]
+        index.vocabulary = pd.Index(saved["vocabulary"], dtype=object)
+        index.cities = pd.Index(saved["cities"], dtype=object)
+        index.ufs = pd.Index(saved["ufs"], dtype=object)
+        return index
+
+    @classmethod
+    def from_dataframe(cls, df, name_column="NOME", city_column="CIDADE", uf_column="UF", **kwargs):
+        return cls(
+            df[name_column].tolist(),
+            df[city_column].tolist() if city_column in df.columns else None,
+            df[uf_column].tolist() if uf_column in df.columns else None,
+            **kwargs,
+        )
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _candidates(self, names):
+        """
+        (query, row) pairs sharing at least two of the query's rarest
+        trigrams (q-gram count filter), or the only one it has. The rarest
+        trigram is always used; the next ones only when their posting list
+        is at most max_postings long
+        """
+        trigrams, owner = _flat_trigrams(names)
+        codes = self.vocabulary.get_indexer(trigrams)
+        known = codes >= 0
+        owner, codes = owner[known], codes[known]
+        frequency = self.frequency[codes]
+
+        order = np.lexsort((frequency, owner))
+        owner, codes, frequency = owner[order], codes[order], frequency[order]
+        rank = np.arange(len(owner)) - np.searchsorted(owner, owner)
+        selected = (rank == 0) | ((rank < BLOCK_TRIGRAMS) & (frequency <= self.max_postings))
+        owner, codes, frequency = owner[selected], codes[selected], frequency[selected]
+
+        # Expand every selected trigram into its posting list, then count
+        # how many of them each (query, row) pair shares
+        total = int(frequency.sum())
+        starts = np.repeat(self.offsets[codes] - np.cumsum(frequency) + frequency, frequency)
+        rows = self.postings[starts + np.arange(total)]
+        keys = np.repeat(owner.astype(np.int64), frequency) * len(self) + rows
+        keys.sort()
+        first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        shared = np.diff(np.r_[first, len(keys)])
+        keys = keys[first]
+        queries, rows = keys // len(self), keys % len(self)
+        blocking = np.bincount(owner, minlength=len(names))
+        keep = (shared >= 2) | (blocking[queries] < 2)
+        return queries[keep], rows[keep]
+
+    def match(self, names, cities=None, ufs=None, min_score=MIN_SCORE, batch_size=5_000):
+        """
+        Best row of the index for each query, as a DataFrame with `row`
+        (-1 when nothing scores at least min_score) and `score`
+        """
+        count = len(names)
+        names = list(names)
+        cities = _query_codes(self.cities, _normalized(cities if cities is not None else [""] * count,
+                                                       normalize_name))
+        ufs = _query_codes(self.ufs, _normalized(ufs if ufs is not None else [""] * count, _uf))
+        best_row = np.full(count, -1, dtype=np.int64)
+        best_score = np.zeros(count)
+
+        for start in range(0, count, batch_size):
+            batch = slice(start, min(start + batch_size, count))
+            queries, rows = self._candidates(names[batch])
+            if not len(queries):
+                continue
+            signatures = trigram_signatures(names[batch])
+            scores = match_score(
+                dice(signatures[queries], self.signatures[rows]),
+                cities[batch][queries], self.city_codes[rows], ufs[batch][queries], self.uf_codes[rows],
+                unknown=-1,
+            )
+            # Highest score per query: sort by query, then score descending
+            order = np.lexsort((-scores, queries))
+            first = order[np.r_[True, queries[order][1:] != queries[order][:-1]]]
+            winners = first[scores[first] >= min_score]
+            best_row[start + queries[winners]] = rows[winners]
+            best_score[start + queries[winners]] = scores[winners]
+
+        return pd.DataFrame({"row": best_row, "score": best_score.round(4)})
+
+    def match_records(self, df, min_score=MIN_SCORE, **kwargs):
+        """match() over scraped (Nome/Cidade/UF) or enriched (NOME/CIDADE/UF) rows"""
+        def column(*names):
+            for name in names:
+                if name in df.columns:
+                    return df[name].tolist()
+            return None
+
+        matches = self.match(column("Nome", "NOME"), column("Cidade", "CIDADE"), column("UF"),
+                             min_score=min_score, **kwargs)
+        matches.index = df.index
+        return matches
+
+
+def _phone_digits(phone):
+    if isinstance(phone, dict):
+        if phone.get("ddd") or phone.get("numero"):
+            return normalize_phone(phone.get("ddd"), phone.get("numero"))
+        phone = phone.get("telefone") or phone.get("number") or ""
+    return normalize_phone(phone)
+
+
+def _address_text(address):
+    if isinstance(address, dict):
+        parts = [address.get(key) for key in ("logradouro", "numero", "bairro")]
+        text = ", ".join(cell_text(part) for part in parts if cell_text(part))
+        city, uf = cell_text(address.get("cidade")), cell_text(address.get("uf"))
+        return f"{text} - {city}/{uf}" if city or uf else text
+    return cell_text(address)
+
+
+def _address_fields(address):
+    """(city, UF, CEP) of an address dict or of a "... - CIDADE/UF" string, as written"""
+    if isinstance(address, dict):
+        return cell_text(address.get("cidade")), _uf(address.get("uf")), cell_text(address.get("cep"))
+    text = cell_text(address)
+    found = _CITY_UF.search(text.upper())
+    cep = _CEP.search(text)
+    return (found.group(1).strip() if found else "", found.group(2) if found else "",
+            cep.group(0) if cep else "")
+
+
+def _first_email(person):
+    for email in person.get("emails") or []:
+        text = cell_text(email.get("email") if isinstance(email, dict) else email)
+        if text:
+            return text
+    return cell_text(person.get("email"))
+
+
+def address_city_uf(address):
+    """(normalized city, UF) of an address dict or of a "... - CIDADE/UF" string"""
+    if isinstance(address, dict):
+        return normalize_name(address.get("cidade")), _uf(address.get("uf"))
+    found = _CITY_UF.search(cell_text(address).upper())
+    if not found:
+        return "", ""
+    return normalize_name(found.group(1)), found.group(2)
+
+
+def best_phone(phones, uf=""):
+    """
+    Phone to use among a person's phones: mobile numbers first, within
+    them and the landlines the ones with a DDD of the UF, then list order
+    """
+    ddds = DDDS_BY_UF.get(_uf(uf), ())
+
+    def rank(item):
+        position, phone = item
+        digits = _phone_digits(phone)
+        mobile = len(digits) == 11 and digits[2] == "9"
+        return (not mobile, digits[:2] not in ddds, position)
+
+    usable = [(position, phone) for position, phone in enumerate(phones or []) if _phone_digits(phone)]
+    return min(usable, key=rank)[1] if usable else None
+
+
+def best_address(addresses, city="", uf=""):
+    """Address in the record's city (or at least its UF), else the first one"""
+    city, uf = normalize_name(city), _uf(uf)
+
+    def rank(item):
+        position, address = item
+        address_city, address_uf = address_city_uf(address)
+        return (not (city and address_city == city), not (uf and address_uf == uf), position)
+
+    usable = [(position, address) for position, address in enumerate(addresses or []) if address]
+    return min(usable, key=rank)[1] if usable else None
+
+
+def lemitti_candidates(data):
+    """People of a Lemitti response: a single person or a list under resultados/pessoas/data"""
+    if isinstance(data, list):
+        people = data
+    elif isinstance(data, dict):
+        people = next((data[key] for key in ("resultados", "pessoas", "empresas", "data")
+                       if isinstance(data.get(key), list)), [data])
+    else:
+        people = []
+    return [person for person in people
+            if isinstance(person, dict) and (person.get("telefones") or person.get("enderecos"))]
+
+
+def pick_contact(record, candidates, min_score=MIN_SCORE):
+    """
+    Contact of the candidate that best matches the CRM record (Nome/NOME,
+    Cidade/CIDADE, UF), or None if none scores min_score: the
+    CONTACT_COLUMNS plus Telefone, Endereço and Similaridade, like the
+    offline export lookup returns them.
+    A candidate without a name is taken as named like the query, since
+    Lemitti was searched by that name
+    """
+    if not candidates:
+        return None
+    name = record.get("Nome") or record.get("NOME") or ""
+    city = normalize_name(record.get("Cidade") or record.get("CIDADE"))
+    uf = _uf(record.get("UF"))
+
+    candidate_names = [person.get("nome") or person.get("razao_social") or name for person in candidates]
+    candidate_places = [
+        # Where the candidate lives: the address in the record's city if any, else the first
+        address_city_uf(best_address(person.get("enderecos"), city, uf) or "")
+        for person in candidates
+    ]
+    scores = match_score(
+        np.array([name_similarity(name, candidate_name) for candidate_name in candidate_names]),
+        np.array([city] * len(candidates), dtype=object),
+        np.array([place[0] for place in candidate_places], dtype=object),
+        np.array([uf] * len(candidates), dtype=object),
+        np.array([place[1] for place in candidate_places], dtype=object),
+    )
+    best = int(np.argmax(scores))
+    if scores[best] < min_score:
+        logger.debug("Nenhum candidato Lemitti confere com %s (melhor: %.2f)", name, scores[best])
+        return None
+    person = candidates[best]
+    phone = best_phone(person.get("telefones"), uf)
+    digits = _phone_digits(phone) if phone is not None else ""
+    address = best_address(person.get("enderecos"), city, uf)
+    address_text = _address_text(address) if address is not None else ""
+    address_city, address_uf, cep = _address_fields(address) if address is not None else ("", "", "")
+    return {
+        "NOME": cell_text(person.get("nome") or person.get("razao_social")) or name,
+        "CPF/CNPJ": cell_text(person.get("cpf") or person.get("cnpj")),
+        "DDD": digits[:2],
+        "FONE": digits[2:],
+        "EMAIL-1": _first_email(person),
+        "CIDADE": address_city or cell_text(record.get("Cidade") or record.get("CIDADE")),
+        "UF": address_uf or uf,
+        "CEP": cep,
+        "FULL-LOGRADOURO": address_text,
+        "Telefone": digits or "Não disponível",
+        "Endereço": address_text or "Não disponível",
+        "Similaridade": round(float(scores[best]), 4),
+    }
@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+
+class _Series:
+    """Latency samples and counters for a single stage or endpoint"""
+
+    def __init__(self, max_samples):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.errors = 0
+        self.items = 0
+        self.total_seconds = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def add(self, started, seconds, items=1, error=False):
+        self.samples.append(seconds)
+        self.count += 1
+        self.items += items
+        self.total_seconds += seconds
+        if error:
+            self.errors += 1
+        if self.first_start is None or started < self.first_start:
+            self.first_start = started
+        end = started + seconds
+        if self.last_end is None or end > self.last_end:
+            self.last_end = end
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        span = (self.last_end - self.first_start) if self.count else 0.0
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "items": self.items,
+            "total_seconds": round(self.total_seconds, 6),
+            "p50": _percentile(ordered, 50),
+            "p95": _percentile(ordered, 95),
+            "p99": _percentile(ordered, 99),
+            "throughput_per_s": round(self.items / span, 3) if span > 0 else None,
+        }
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return round(ordered[index], 6)
+
+
+class _Timing:
+    """Handle yielded by the timers so callers can attach item counts and status"""
+
+    def __init__(self):
+        self.items = 1
+        self.status = None
+        self.error = False
+        self.retried = False
+
+
+class Metrics:
+    """
+    In-process registry of timers and counters for the pipeline stages
+    (scrape, parse, lemitti, rd_station, tallos) and for each external endpoint
+    """
+
+    def __init__(self, max_samples=5000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._endpoints = {}
+        self._counters = {}
+        # Stages open in each thread, innermost last
+        self._open = threading.local()
+
+    def _record(self, table, name, started, seconds, items, error):
+        with self._lock:
+            series = table.get(name)
+            if series is None:
+                series = table[name] = _Series(self.max_samples)
+            series.add(started, seconds, items, error)
+
+    def _open_stages(self):
+        stages = getattr(self._open, "stages", None)
+        if stages is None:
+            stages = self._open.stages = []
+        return stages
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a pipeline stage; set `.items` on the handle for batch stages.
+        The stage counts as an error when it raises or when a request made
+        inside it (same thread) fails, since the API clients catch request
+        errors and return None or an error dict instead of raising
+        """
+        timing = _Timing()
+        started = time.time()
+        clock = time.perf_counter()
+        stages = self._open_stages()
+        stages.append(timing)
+        try:
+            yield timing
+        except Exception:
+            timing.error = True
+            raise
+        finally:
+            stages.pop()
+            self._record(self._stages, name, started, time.perf_counter() - clock,
+                         timing.items, timing.error)
+
+    @contextmanager
+    def request(self, endpoint):
+        """
+        Time one attempt of a call to an external endpoint; set `.status` to
+        the HTTP status code, and `.retried` when the call is made again, so
+        a failure that gets retried does not fail the enclosing stage
+        """
+        timing = _Timing()
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            yield timing
+        except Exception:
+            timing.error = True
+            raise
+        finally:
+            error = timing.error or (timing.status is not None and timing.status >= 400)
+            stages = self._open_stages()
+            if error and stages and not timing.retried:
+                stages[-1].error = True
+            self._record(self._endpoints, endpoint, started, time.perf_counter() - clock, 1, error)
+            if timing.status is not None:
+                self.inc(f"http_status_{timing.status}", endpoint=endpoint)
+
+    def timed(self, name):
+        """Decorator version of `stage`"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inc(self, name, value=1, endpoint=None):
+        key = (name, endpoint)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._endpoints.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {name: s.summary() for name, s in self._stages.items()},
+                "endpoints": {name: s.summary() for name, s in self._endpoints.items()},
+                "counters": [
+                    {"name": name, "endpoint": endpoint, "value": value}
+                    for (name, endpoint), value in self._counters.items()
+                ],
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def to_prometheus(self):
+        """Export the snapshot in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        lines = []
+        for kind in ("stages", "endpoints"):
+            label = "stage" if kind == "stages" else "endpoint"
+            prefix = f"pipeline_{label}"
+            lines.append(f"# TYPE {prefix}_latency_seconds summary")
+            for name, summary in snap[kind].items():
+                tag = f'{label}="{_escape(name)}"'
+                for quantile in ("p50", "p95", "p99"):
+                    if summary[quantile] is not None:
+                        q = int(quantile[1:]) / 100
+                        lines.append(f'{prefix}_latency_seconds{{{tag},quantile="{q}"}} {summary[quantile]}')
+                lines.append(f"{prefix}_latency_seconds_sum{{{tag}}} {summary['total_seconds']}")
+                lines.append(f"{prefix}_latency_seconds_count{{{tag}}} {summary['count']}")
+                lines.append(f"{prefix}_errors_total{{{tag}}} {summary['errors']}")
+                lines.append(f"{prefix}_items_total{{{tag}}} {summary['items']}")
+                if summary["throughput_per_s"] is not None:
+                    lines.append(f"{prefix}_throughput_per_second{{{tag}}} {summary['throughput_per_s']}")
+        for counter in snap["counters"]:
+            tag = f'{{endpoint="{_escape(counter["endpoint"])}"}}' if counter["endpoint"] else ""
+            lines.append(f"pipeline_{counter['name']}_total{tag} {counter['value']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+# Shared registry used by the app and the API clients
+metrics = Metrics()
@@ -0,0 +1,188 @@
+"""
+National CRM crawl on a process pool.
+
+The work is split into shards of (UF, page range). Each worker process owns
+its own Chrome driver, so the browser and the BeautifulSoup parsing of one
+shard never wait on another shard's GIL. Every shard is written to its own
+CSV in the output directory and the files are merged, without duplicates,
+at the end:
+
+    python parallel_scrape.py --output-dir crawl --workers 8
+    python parallel_scrape.py --ufs MA PI --pages-per-shard 50 --workers 8
+
+Shard files that already exist are kept, so an interrupted crawl can be
+restarted with the same arguments and only the missing shards are fetched.
+A shard with pages that could not be reached is written as .partial
+instead, so it is fetched again on the next run.
+"""
+import argparse
+import csv
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import crm_scraper
+from dedup import Deduplicator
+from log_utils import configure_logging
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ["Nome", "CRM", "Cidade", "UF", "DT_NASCIMENTO"]
+
+
+def shard_path(output_dir, uf, first_page, last_page):
+    last = last_page if last_page else "fim"
+    return os.path.join(output_dir, f"shard_{uf}_{first_page}-{last}.csv")
+
+
+def plan_shards(ufs, pages_per_shard=None, page_counts=None):
+    """
+    (uf, first_page, last_page) work items. Without pages_per_shard each UF
+    is a single shard; otherwise page_counts[uf] is split into page ranges
+    """
+    shards = []
+    for uf in ufs:
+        if not pages_per_shard:
+            shards.append((uf, 1, None))
+            continue
+        total_pages = page_counts[uf]
+        for first_page in range(1, total_pages + 1, pages_per_shard):
+            shards.append((uf, first_page, min(first_page + pages_per_shard - 1, total_pages)))
+    return shards
+
+
+def _write_rows(path, rows):
+    # Written under a temporary name so a killed worker never leaves a partial shard behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, delimiter=";", extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def _init_worker():
+    configure_logging()
+
+
+def count_pages(uf, situacao):
+    return uf, crm_scraper.count_search_pages(uf, situacao=situacao)
+
+
+@profiler.profiled("scrape")
+def scrape_shard(uf, first_page, last_page, output_dir, situacao="ATIVO"):
+    """
+    Crawl one shard in the current process and write it to its CSV, or to
+    <shard>.partial when some pages failed, so resume does not skip it
+    """
+    start = time.perf_counter()
+    rows = []
+    failed_pages = []
+    for _, _, page_results in crm_scraper.iter_search_pages(
+            "", uf, situacao, first_page=first_page, last_page=last_page, failed_pages=failed_pages):
+        rows.extend(page_results)
+    path = shard_path(output_dir, uf, first_page, last_page)
+    if failed_pages:
+        path += ".partial"
+    elif os.path.exists(f"{path}.partial"):
+        os.remove(f"{path}.partial")
+    _write_rows(path, rows)
+    return {"uf": uf, "first_page": first_page, "last_page": last_page, "rows": len(rows),
+            "failed_pages": failed_pages, "seconds": round(time.perf_counter() - start, 1), "path": path}
+
+
+def merge_shards(output_dir, merged_path):
+    """Concatenate every shard CSV, dropping doctors found by more than one shard"""
+    merge_dedup = Deduplicator("merge")
+    total = 0
+    written = 0
+    with open(merged_path, "w", newline="", encoding="utf-8") as out:
+        writer = csv.DictWriter(out, fieldnames=FIELDS, delimiter=";")
+        writer.writeheader()
+        for path in sorted(glob.glob(os.path.join(output_dir, "shard_*.csv"))):
+            with open(path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f, delimiter=";"))
+            total += len(rows)
+            unique = merge_dedup.filter(rows)
+            writer.writerows(unique)
+            written += len(unique)
+    return {"rows": total, "written": written, "duplicates": total - written}
+
+
+def run(ufs, output_dir, workers=None, pages_per_shard=None, situacao="ATIVO"):
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        page_counts = None
+        if pages_per_shard:
+            # Page ranges need the page count of each UF, which is itself a search
+            page_counts = {}
+            counts = {pool.submit(count_pages, uf, situacao): uf for uf in ufs}
+            for future in as_completed(counts):
+                uf = counts[future]
+                try:
+                    page_counts[uf] = future.result()[1]
+                except Exception as e:
+                    logger.error("Contagem de páginas de %s falhou: %s", uf, e)
+                    failed.append((uf, None, None))
+            logger.info("Páginas por UF: %s", page_counts)
+            ufs = [uf for uf in ufs if uf in page_counts]
+
+        shards = [shard for shard in plan_shards(ufs, pages_per_shard, page_counts)
+                  if not os.path.exists(shard_path(output_dir, *shard))]
+        logger.info("%d shards a processar com %d processos", len(shards), workers)
+
+        futures = {
+            pool.submit(scrape_shard, uf, first_page, last_page, output_dir, situacao): (uf, first_page, last_page)
+            for uf, first_page, last_page in shards
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                result = future.result()
+                logger.info("Shard %s páginas %s-%s: %d médicos em %.1fs", result["uf"],
+                            result["first_page"], result["last_page"] or "fim",
+                            result["rows"], result["seconds"])
+                if result["failed_pages"]:
+                    logger.error("Shard %s: páginas %s não carregaram; gravado em %s", shard,
+                                 result["failed_pages"], result["path"])
+                    failed.append(shard)
+            except Exception as e:
+                logger.error("Shard %s falhou: %s", shard, e)
+                failed.append(shard)
+    return failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Busca de médicos em todas as UFs com vários processos")
+    parser.add_argument("--ufs", nargs="*", default=crm_scraper.UFS, choices=crm_scraper.UFS)
+    parser.add_argument("--situacao", default="ATIVO", choices=["ATIVO", "INATIVO"])
+    parser.add_argument("--workers", type=int, help="processos (padrão: núcleos da máquina)")
+    parser.add_argument("--pages-per-shard", type=int,
+                        help="divide cada UF em faixas de páginas; sem isso, um shard por UF")
+    parser.add_argument("--output-dir", default="crawl")
+    parser.add_argument("--merged", help="CSV final (padrão: <output-dir>/medicos.csv)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    configure_logging()
+    args = parse_args(argv)
+    failed = run(args.ufs, args.output_dir, args.workers, args.pages_per_shard, args.situacao)
+    merged_path = args.merged or os.path.join(args.output_dir, "medicos.csv")
+    summary = merge_shards(args.output_dir, merged_path)
+    logger.info("%d médicos gravados em %s (%d duplicados removidos)",
+                summary["written"], merged_path, summary["duplicates"])
+    if failed:
+        logger.error("%d shards falharam; execute novamente para completá-los", len(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
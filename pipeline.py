@@ -0,0 +1,297 @@
+"""
+Scrape, enrich and send stages written as background job functions.
+Each takes the JobContext from jobs.JobRunner as first argument.
+"""
+import datetime
+import logging
+import time
+import os
+import queue
+
+import crm_scraper
+from campaign import build_contact_payload, send_contact_message
+from campaign_stream import StreamingCampaign, iter_csv_chunks
+from enrichment_index import open_index
+from matching import CONTACT_COLUMNS
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+# Partial results are flushed to the job table in batches of this size
+RESULTS_BATCH = 50
+
+# Scraped records looked up in the offline export at a time
+ENRICH_BATCH = 1_000
+
+# Marks the end of a page stream between two jobs
+END_OF_STREAM = None
+
+# How often a job blocked on a page stream checks for cancellation
+STREAM_POLL_SECONDS = 1.0
+
+# Every enriched row has the same columns, found by either source or not at all
+ENRICHED_BLANK = dict.fromkeys(CONTACT_COLUMNS + ["Telefone", "Endereço", "Similaridade"], "")
+
+
+class _ResultBuffer:
+    def __init__(self, job, size=RESULTS_BATCH):
+        self.job = job
+        self.size = size
+        self.rows = []
+
+    def add(self, record):
+        self.rows.append(record)
+        if len(self.rows) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.job.add_results(self.rows)
+            self.rows = []
+
+
+@profiler.profiled("scrape")
+def scrape_job(job, nome, uf, situacao="ATIVO", especialidade="", area_atuacao="",
+               rd_station_api=None, rd_dedup=None, page_stream=None):
+    """
+    CRM search; each parsed page is published as partial results right away
+    and, when page_stream (a queue.Queue) is given, handed to the enrichment
+    job so both stages run at the same time. The stream is closed with
+    END_OF_STREAM by the submitter (JobRunner.submit on_finish), so it is
+    closed even when this job is cancelled before it starts
+    """
+    chats = 0
+    total = 0
+    failed_pages = []
+    for page, total_pages, page_results in crm_scraper.iter_search_pages(
+            nome, uf, situacao, especialidade, area_atuacao, should_stop=lambda: job.cancelled,
+            failed_pages=failed_pages):
+        total += len(page_results)
+        job.add_results(page_results)
+        if page_stream is not None and page_results:
+            page_stream.put(page_results)
+        if rd_station_api:
+            new_doctors = rd_dedup.filter(page_results) if rd_dedup else page_results
+            for doctor_data in new_doctors:
+                if rd_station_api.start_chat_conversation(doctor_data):
+                    chats += 1
+        job.set_progress(page, total_pages, f"Página {page} de {total_pages}")
+    if failed_pages:
+        logger.warning("Busca %s/%s: páginas %s não carregaram", nome, uf, failed_pages)
+    return {"total": total, "chats": chats, "failed_pages": failed_pages}
+
+
+def _enrich_batch(job, buffer, records, lemitti_api, enrichment_export, counts):
+    """
+    Offline lookup of the whole batch in the Lemit export first; only the
+    doctors it does not have go to the Lemitti API, when one is given
+    """
+    job.check_cancelled()
+    contacts = [None] * len(records)
+    if enrichment_export:
+        contacts = open_index(enrichment_export).enrich(records)
+        counts["offline"] += sum(contact is not None for contact in contacts)
+    for record, contact in zip(records, contacts):
+        if contact is None and lemitti_api is not None:
+            job.check_cancelled()
+            contact = lemitti_api.search_doctor(record.get("Nome") or record.get("NOME", ""), record=record)
+            counts["api"] += contact is not None
+        buffer.add({**ENRICHED_BLANK, **record, **(contact or {})})
+
+
+@profiler.profiled("enrich")
+def enrich_job(job, records, lemitti_api=None, enrichment_export=None):
+    """
+    Phone/address for each scraped doctor, from the local Lemit export
+    and/or the Lemitti API; what is found is merged into the record
+    """
+    buffer = _ResultBuffer(job)
+    counts = {"offline": 0, "api": 0}
+    total = len(records)
+    try:
+        for start in range(0, total, ENRICH_BATCH):
+            _enrich_batch(job, buffer, records[start:start + ENRICH_BATCH], lemitti_api, enrichment_export, counts)
+            job.set_progress(min(start + ENRICH_BATCH, total), total,
+                             f"{counts['offline'] + counts['api']} contatos encontrados")
+    finally:
+        buffer.flush()
+    return {"total": total, "found": counts["offline"] + counts["api"], **counts}
+
+
+@profiler.profiled("enrich")
+def enrich_stream_job(job, page_stream, lemitti_api=None, enrichment_export=None):
+    """Same as enrich_job, consuming the pages of a running scrape job as they arrive"""
+    buffer = _ResultBuffer(job, size=10)
+    counts = {"offline": 0, "api": 0}
+    done = 0
+    try:
+        while True:
+            try:
+                page_results = page_stream.get(timeout=STREAM_POLL_SECONDS)
+            except queue.Empty:
+                job.check_cancelled()
+                continue
+            if page_results is END_OF_STREAM:
+                break
+            _enrich_batch(job, buffer, page_results, lemitti_api, enrichment_export, counts)
+            done += len(page_results)
+            buffer.flush()
+            job.set_progress(done, done + page_stream.qsize() * crm_scraper.RESULTS_PER_PAGE,
+                             f"{counts['offline'] + counts['api']} contatos encontrados")
+    finally:
+        buffer.flush()
+    return {"total": done, "found": counts["offline"] + counts["api"], **counts}
+
+
+def _message_id(response):
+    if isinstance(response, dict):
+        return response.get("message_id") or response.get("_id")
+    return None
+
+
+@profiler.profiled("send")
+def send_job(job, tallos_api, records, message_template, selected_operator_id, selected_integration,
+             template_id=None, store=None, scheduler=None):
+    """
+    Campaign send: every contact is created up front with one bulk import,
+    then send_message runs for each row
+
+    With a ChatHistoryStore, every message sent is recorded under the job id
+    so replies can be matched to the campaign later. With a CampaignScheduler
+    the rows go out in priority order, inside the send windows and quotas
+    """
+    # Scheduled sends are spread out, so each row is published as soon as it is sent
+    batch_size = 1 if scheduler else RESULTS_BATCH
+    buffer = _ResultBuffer(job, size=batch_size)
+    sends = []
+    success_count = 0
+    total = len(records)
+
+    # Rows whose payload cannot be built are reported by send_contact_message
+    phones = {}
+    for index, contact_data in enumerate(records):
+        try:
+            phones[index] = build_contact_payload(contact_data, selected_integration)
+        except (ValueError, KeyError, TypeError):
+            pass
+    job.set_progress(0, total, f"Criando {len(phones)} contatos")
+    imported = tallos_api.import_contacts(list(phones.values()))
+    customer_ids = imported["ids"]
+    job.set_progress(0, total, f"{imported['stats']['created']} contatos criados, "
+                               f"{imported['stats']['failed']} com erro")
+    phones = {index: payload["cel_phone"] for index, payload in phones.items()}
+
+    done = 0
+    if scheduler:
+        ordered = scheduler.release(
+            records,
+            should_stop=lambda: job.cancelled,
+            on_wait=lambda send_at: job.set_progress(
+                done, total, f"{success_count} mensagens enviadas; próximo envio às "
+                             f"{datetime.datetime.fromtimestamp(send_at):%d/%m %H:%M}"
+            ),
+        )
+    else:
+        ordered = enumerate(records)
+
+    try:
+        for index, contact_data in ordered:
+            job.check_cancelled()
+            if index in phones and phones[index] not in customer_ids:
+                outcome = {"status": "error",
+                           "message": f"Erro ao criar contato: {contact_data.get('NOME', 'Unknown')}"}
+            else:
+                outcome = send_contact_message(
+                    tallos_api, contact_data, message_template, selected_operator_id, selected_integration,
+                    customer_id=customer_ids.get(phones.get(index))
+                )
+            if outcome["status"] == "success":
+                success_count += 1
+                sends.append({
+                    "campaign_id": job.job_id,
+                    "customer_id": outcome["customer_id"],
+                    "template_id": template_id,
+                    "operator_id": selected_operator_id,
+                    "message_id": _message_id(outcome.get("response")),
+                    "sent_at": time.time(),
+                })
+                if store and len(sends) >= batch_size:
+                    store.record_sends(sends)
+                    sends = []
+            buffer.add({
+                "NOME": contact_data.get("NOME", ""),
+                "status": outcome["status"],
+                "customer_id": outcome.get("customer_id"),
+                "erro": outcome.get("message"),
+            })
+            done += 1
+            job.set_progress(done, total, f"{success_count} mensagens enviadas")
+    finally:
+        buffer.flush()
+        if store:
+            store.record_sends(sends)
+    return {"total": total, "success": success_count, "import": imported["stats"]}
+
+
+@profiler.profiled("send")
+def stream_send_job(job, tallos_api, csv_path, message_template, selected_operator_id, selected_integration,
+                    template_id=None, store=None, remove_file=False):
+    """
+    Campaign send straight from the enriched CSV on disk, for files too big
+    to load: chunks flow through bounded queues (see campaign_stream), so
+    memory stays flat whatever the number of rows. Duplicated and invalid
+    rows are skipped on the way. With remove_file the CSV is deleted at the end
+    """
+    buffer = _ResultBuffer(job)
+    sends = []
+    stream = StreamingCampaign(
+        tallos_api, message_template, selected_operator_id, selected_integration,
+        should_stop=lambda: job.cancelled
+    )
+
+    # Called from the campaign's single results thread
+    def on_result(contact_data, outcome):
+        if outcome["status"] == "success":
+            sends.append({
+                "campaign_id": job.job_id,
+                "customer_id": outcome["customer_id"],
+                "template_id": template_id,
+                "operator_id": selected_operator_id,
+                "message_id": _message_id(outcome.get("response")),
+                "sent_at": time.time(),
+            })
+            if store and len(sends) >= RESULTS_BATCH:
+                store.record_sends(sends)
+                sends.clear()
+        buffer.add({
+            "NOME": contact_data.get("NOME", ""),
+            "status": outcome["status"],
+            "customer_id": outcome.get("customer_id"),
+            "erro": outcome.get("message"),
+        })
+        stats = stream.stats
+        done = stats["sent"] + stats["errors"]
+        if done % RESULTS_BATCH == 0:
+            job.set_progress(done, None, f"{stats['rows']} linhas lidas, {stats['sent']} mensagens enviadas")
+
+    try:
+        stats = stream.run(iter_csv_chunks(csv_path), on_result)
+    finally:
+        buffer.flush()
+        if store:
+            store.record_sends(sends)
+        if remove_file:
+            os.remove(csv_path)
+    return {"total": stats["rows"], "success": stats["sent"], "stream": stats,
+            "dedup": stream.dedup.report()}
+
+
+def chat_sync_job(job, tallos_api, store):
+    """Incremental download of the Tallos chat history into the local store"""
+    return store.sync(
+        tallos_api,
+        should_stop=lambda: job.cancelled,
+        on_page=lambda page, fetched, added: job.set_progress(
+            page, message=f"Página {page}: {fetched} mensagens lidas, {added} novas"
+        ),
+    )
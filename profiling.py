@@ -0,0 +1,345 @@
+"""
+Opt-in sampling profiler for scrape, enrichment and send runs.
+
+While a profiled function runs, a background thread samples the Python
+stacks of the thread running it, and of the threads it starts (directly or
+through threads of its own), every PROFILE_INTERVAL seconds. Each sample is counted as wall time and classified
+by what the thread was doing:
+
+    network   inside socket/ssl/http.client/urllib3/requests or the Selenium
+              driver connection (waiting on the CRM portal or an API)
+    sleep     on a line calling sleep() (page delays, backoff, throttling,
+              WebDriverWait polling)
+    wait      blocked on a lock, queue or future of another thread
+    cpu       anything else: parsing, JSON, pandas, matching
+
+Every run writes a directory under PROFILE_DIR with the samples in
+speedscope format (https://www.speedscope.app), a pstats file built from the
+same samples (python -m pstats) and a summary.json with the breakdown and
+the hottest call paths shown in the app's debug section.
+
+Profiling is off unless PROFILE_RUNS=1 or `profiler.enabled` is set; nested
+profiled calls (a Lemitti lookup inside an enrich job) join the outer run.
+Threads started elsewhere (Streamlit, other jobs) are never sampled: while
+a run is open, threading.Thread.start records the thread that started each
+new thread, and a run only follows its own descendants. The original
+method is put back when the last run ends.
+"""
+import datetime
+import json
+import linecache
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+# Deepest stack kept per sample; the frames nearest the leaf are kept
+MAX_DEPTH = 200
+
+CATEGORIES = ("cpu", "network", "sleep", "wait")
+
+_NETWORK_PATHS = tuple(os.sep + part + os.sep for part in ("urllib3", "requests", "http")) + (
+    os.sep + "socket.py", os.sep + "ssl.py", os.sep + "selectors.py",
+    os.path.join("selenium", "webdriver", "remote", ""),
+)
+_WAIT_PATHS = (os.sep + "threading.py", os.sep + "queue.py", os.path.join("concurrent", "futures", ""))
+
+
+_thread_start = threading.Thread.start
+
+
+def _start_with_parent(thread):
+    thread._profile_parent = threading.current_thread()
+    _thread_start(thread)
+
+
+def _frame_key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def _classify(frame, stack):
+    """Category of a sample, from its leaf frame and the files on its stack"""
+    if "sleep(" in linecache.getline(frame.f_code.co_filename, frame.f_lineno):
+        return "sleep"
+    for filename, _, _ in reversed(stack):
+        if any(part in filename for part in _NETWORK_PATHS):
+            return "network"
+    if any(part in frame.f_code.co_filename for part in _WAIT_PATHS):
+        return "wait"
+    return "cpu"
+
+
+class ProfileRun:
+    """Samples of one profiled call, grouped by thread, stack and category"""
+
+    def __init__(self, name, job_id=None):
+        self.name = name
+        self.job_id = job_id
+        self.owner = threading.get_ident()
+        self.owner_thread = threading.current_thread()
+        # Thread objects rather than idents, which are reused once a thread exits
+        self.known_threads = set(threading.enumerate()) - {self.owner_thread}
+        self.started_at = datetime.datetime.now()
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.seconds = None
+        self.cpu_seconds = None
+        self.error = None
+        self.samples = Counter()  # (thread name, stack, category) -> seconds
+        self.sample_count = 0
+
+    def watches(self, thread):
+        """True for the owner thread and the threads started from it since the run began"""
+        if thread is self.owner_thread:
+            return True
+        if thread is None or thread in self.known_threads:
+            return False
+        parent = getattr(thread, "_profile_parent", None)
+        while parent is not None:
+            if parent is self.owner_thread:
+                return True
+            parent = getattr(parent, "_profile_parent", None)
+        return False
+
+    def add(self, thread_name, leaf, weight):
+        stack = []
+        frame = leaf
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(_frame_key(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        self.samples[(thread_name, tuple(stack), _classify(leaf, stack))] += weight
+        self.sample_count += 1
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        self.cpu_seconds = time.thread_time() - self.cpu_started
+
+    def breakdown(self):
+        """Seconds per category, summed over the sampled threads"""
+        totals = dict.fromkeys(CATEGORIES, 0.0)
+        for (_, _, category), seconds in self.samples.items():
+            totals[category] += seconds
+        return totals
+
+    def flame(self, max_depth=12, min_share=0.01, limit=60):
+        """
+        Hottest call paths as rows (depth, frame, seconds, share), depth
+        first like a flame graph read top-down; paths below `min_share` of
+        the sampled time are dropped
+        """
+        inclusive = defaultdict(float)
+        for (_, stack, _), seconds in self.samples.items():
+            for depth in range(1, min(len(stack), max_depth) + 1):
+                inclusive[stack[:depth]] += seconds
+        total = sum(self.samples.values()) or 1.0
+        children = defaultdict(list)
+        for path, seconds in inclusive.items():
+            if seconds / total >= min_share:
+                children[path[:-1]].append(path)
+
+        rows = []
+
+        def walk(parent):
+            for path in sorted(children.get(parent, ()), key=inclusive.get, reverse=True):
+                if len(rows) >= limit:
+                    return
+                filename, line, function = path[-1]
+                rows.append({
+                    "depth": len(path) - 1,
+                    "frame": f"{function} ({os.path.basename(filename)}:{line})",
+                    "seconds": round(inclusive[path], 3),
+                    "share": round(inclusive[path] / total, 4),
+                })
+                walk(path)
+        walk(())
+        return rows
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "job_id": self.job_id,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "wall_seconds": round(self.seconds, 3),
+            "owner_cpu_seconds": round(self.cpu_seconds, 3),
+            "samples": self.sample_count,
+            "threads": len({thread for thread, _, _ in self.samples}),
+            "breakdown": {category: round(seconds, 3) for category, seconds in self.breakdown().items()},
+            "error": self.error,
+            "flame": self.flame(),
+        }
+
+    def speedscope(self):
+        """The samples in speedscope's file format, one sampled profile per thread"""
+        frames, frame_index = [], {}
+        by_thread = defaultdict(list)
+        for (thread_name, stack, category), seconds in self.samples.items():
+            indexes = []
+            for key in stack:
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    filename, line, function = key
+                    frames.append({"name": function, "file": filename, "line": line})
+                indexes.append(frame_index[key])
+            by_thread[thread_name].append((indexes, seconds))
+        profiles = []
+        for thread_name, entries in by_thread.items():
+            total = sum(seconds for _, seconds in entries)
+            profiles.append({
+                "type": "sampled", "name": thread_name, "unit": "seconds",
+                "startValue": 0, "endValue": total,
+                "samples": [indexes for indexes, _ in entries],
+                "weights": [seconds for _, seconds in entries],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.name} {self.started_at:%Y-%m-%d %H:%M:%S}",
+            "exporter": "gss-saude-search profiling",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def pstats(self):
+        """
+        The samples as a pstats table: sampled seconds as tottime/cumtime and
+        distinct sampled stacks as call counts (not real calls), so
+        `sort_stats("cumulative")` works as usual
+        """
+        stats = {}
+        for (_, stack, _), seconds in self.samples.items():
+            for position, key in enumerate(stack):
+                if key in stack[:position]:
+                    continue  # recursion: count the outermost occurrence only
+                cc, nc, tt, ct, callers = stats.get(key, (0, 0, 0.0, 0.0, {}))
+                if position == len(stack) - 1:
+                    tt += seconds
+                if position:
+                    caller = stack[position - 1]
+                    c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_cc + 1, c_nc + 1, c_tt, c_ct + seconds)
+                stats[key] = (cc + 1, nc + 1, tt, ct + seconds, callers)
+        return stats
+
+    def save(self, root=PROFILE_DIR):
+        """Write summary.json, profile.speedscope.json and profile.pstats; returns the directory and summary"""
+        directory = os.path.join(root, f"{self.started_at:%Y%m%d-%H%M%S}-{self.name}"
+                                       + (f"-{self.job_id}" if self.job_id else ""))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "profile.speedscope.json"), "w", encoding="utf-8") as f:
+            json.dump(self.speedscope(), f)
+        with open(os.path.join(directory, "profile.pstats"), "wb") as f:
+            marshal.dump(self.pstats(), f)
+        summary = self.summary()
+        with open(os.path.join(directory, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return directory, summary
+
+
+class Profiler:
+    """Process-wide registry of the running profiles and their sampling thread"""
+
+    def __init__(self, interval=PROFILE_INTERVAL, root=PROFILE_DIR):
+        self.enabled = os.environ.get("PROFILE_RUNS", "") == "1"
+        self.interval = interval
+        self.root = root
+        self._runs = {}  # owner thread ident -> ProfileRun
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            weight, last = now - last, now
+            # One tick at a time under the lock, so stop() never sees a run mid-update
+            with self._lock:
+                if not self._runs:
+                    self._sampler = None
+                    return
+                threads = {thread.ident: thread for thread in threading.enumerate()}
+                me = threading.get_ident()
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    thread = threads.get(ident)
+                    for run in self._runs.values():
+                        if run.watches(thread):
+                            run.add(thread.name, frame, weight)
+
+    def start(self, name, job_id=None):
+        """Begin a run in the calling thread; None if one is already running there"""
+        run = ProfileRun(name, job_id)
+        with self._lock:
+            if run.owner in self._runs:
+                return None
+            self._runs[run.owner] = run
+            # Patched only while a run is open; threads started outside that span have no parent and are skipped
+            threading.Thread.start = _start_with_parent
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._sampler.start()
+        return run
+
+    def stop(self, run):
+        run.finish()
+        with self._lock:
+            self._runs.pop(run.owner, None)
+            if not self._runs:
+                threading.Thread.start = _thread_start
+        try:
+            directory, summary = run.save(self.root)
+        except OSError:
+            logger.exception("Falha ao gravar o perfil de %s", run.name)
+            return None
+        logger.info("Perfil de %s gravado em %s: %s", run.name, directory, summary["breakdown"])
+        return directory
+
+    def profiled(self, name):
+        """Decorator profiling each call when enabled; a job's JobContext names the run"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                run = self.start(name, job_id=getattr(args[0], "job_id", None) if args else None)
+                if run is None:
+                    return func(*args, **kwargs)
+                try:
+                    return func(*args, **kwargs)
+                except BaseException as e:
+                    run.error = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    self.stop(run)
+            return wrapper
+        return decorator
+
+    def runs(self, limit=20):
+        """Summaries of the latest saved runs, newest first, with their directory"""
+        try:
+            names = sorted(os.listdir(self.root), reverse=True)
+        except FileNotFoundError:
+            return []
+        summaries = []
+        for name in names[:limit]:
+            directory = os.path.join(self.root, name)
+            try:
+                with open(os.path.join(directory, "summary.json"), encoding="utf-8") as f:
+                    summaries.append({**json.load(f), "directory": directory})
+            except (OSError, ValueError):
+                continue
+        return summaries
+
+
+# Shared profiler used by the pipeline jobs and the API clients
+profiler = Profiler()
@@ -0,0 +1,54 @@
+import logging
+from metrics import metrics
+from governor import governor
+from log_utils import log_sampled, truncate
+
+logger = logging.getLogger(__name__)
+
+class RDStationAPI:
+    def __init__(self, token, base_url="https://api.rd.services"):
+        self.base_url = base_url
+        self.headers = {
+            "accept": "application/json",
+            "content-type": "application/json",
+            "Authorization": f"Bearer {token}"
+        }
+
+    @metrics.timed("rd_station")
+    def start_chat_conversation(self, doctor_data):
+        """
+        Starts a chat conversation in RD Station for a found doctor
+        """
+        try:
+            payload = {
+                "event_type": "CHAT_STARTED",
+                "event_family": "CDP",
+                "payload": {
+                    "chat_subject": "Confirmação de Dados Médicos",
+                    "cf_chat_status": "Online",
+                    "email": doctor_data.get('email', ''),  # If email is available
+                    "name": doctor_data.get('Nome', ''),
+                    "city": doctor_data.get('Cidade', ''),
+                    "uf": doctor_data.get('UF', '')
+                }
+            }
+
+            response = governor.request(
+                "POST",
+                f"{self.base_url}/platform/events",
+                json=payload,
+                headers=self.headers,
+                endpoint="rd_station POST /platform/events"
+            )
+
+            if response.status_code == 200:
+                log_sampled(logger, logging.INFO, "rd_station.chat",
+                            "Chat iniciado com sucesso para médico: %s", doctor_data.get('Nome'))
+                return True
+            else:
+                logger.error("Erro ao iniciar chat: %s - %s", response.status_code, truncate(response.text))
+                return False
+
+        except Exception as e:
+            logger.error(f"Erro ao iniciar chat RD Station: {str(e)}")
+            return False
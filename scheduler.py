@@ -0,0 +1,255 @@
+"""
+Campaign send scheduling: allowed time windows, rolling quotas per
+WhatsApp integration and per operator, a priority queue of contacts and an
+even send rate.
+
+The scheduler decides *when* each contact may be sent; the governor still
+decides how fast the HTTP calls themselves go. Quotas are shared by every
+campaign of the process, so two campaigns on the same number add up.
+"""
+import bisect
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from dedup import cell_text
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+HOUR = 3600
+
+# Business-initiated conversations per rolling 24h of each WhatsApp Business tier
+MESSAGING_TIERS = {
+    "250": 250,
+    "1K": 1_000,
+    "10K": 10_000,
+    "100K": 100_000,
+    "Ilimitado": None,
+}
+
+# Longest single sleep, so cancellation is noticed quickly
+MAX_SLEEP = 5.0
+
+
+@dataclass(frozen=True)
+class SendWindow:
+    """Daily period in which messages may go out, on the given weekdays (0 = Monday)"""
+    start: datetime.time
+    end: datetime.time
+    weekdays: tuple = (0, 1, 2, 3, 4)
+
+
+DEFAULT_WINDOWS = (
+    SendWindow(datetime.time(9), datetime.time(18)),
+    SendWindow(datetime.time(9), datetime.time(12), weekdays=(5,)),
+)
+
+
+class RollingQuota:
+    """At most `limit` events in any `period` seconds"""
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        # Event times in ascending order; the ones before _start have expired
+        self.events = []
+        self._start = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        self._start = bisect.bisect_right(self.events, now - self.period, lo=self._start)
+        # Drop the expired prefix once it is the larger part of the list
+        if self._start > 1024 and self._start * 2 > len(self.events):
+            del self.events[:self._start]
+            self._start = 0
+
+    def available_at(self, now):
+        """Earliest time, from `now` on, at which one more event fits"""
+        if self.limit is None:
+            return now
+        with self._lock:
+            self._prune(now)
+            if len(self.events) - self._start < self.limit:
+                return now
+            return self.events[len(self.events) - self.limit] + self.period
+
+    def capacity(self, now, until):
+        """
+        Events that still fit between `now` and `until`: the ones counted at
+        `until` are those after until - period, so older events free their
+        slots along the way, and each further period adds a full limit
+        """
+        if self.limit is None:
+            return None
+        with self._lock:
+            self._prune(now)
+            cutoff = until - self.period
+            still_counted = len(self.events) - bisect.bisect_right(self.events, cutoff, lo=self._start)
+        extra_periods = max(0.0, until - now - self.period) / self.period
+        return max(0, self.limit - still_counted) + int(self.limit * extra_periods)
+
+    def add(self, now):
+        # Nothing to count against without a limit
+        if self.limit is None:
+            return
+        with self._lock:
+            if self.events and now < self.events[-1]:
+                bisect.insort(self.events, now, lo=self._start)
+            else:
+                self.events.append(now)
+
+    def copy(self):
+        quota = RollingQuota(self.limit, self.period)
+        with self._lock:
+            quota.events = self.events[self._start:]
+        return quota
+
+
+_quotas = {}
+_quotas_lock = threading.Lock()
+
+
+def shared_quota(kind, key, limit, period):
+    """Process-wide quota for an integration or operator; the latest limit wins"""
+    with _quotas_lock:
+        quota = _quotas.get((kind, key))
+        if quota is None:
+            quota = _quotas[(kind, key)] = RollingQuota(limit, period)
+        quota.limit = limit
+        return quota
+
+
+def make_priority(column=None, order=None):
+    """
+    Sort key for contacts: by the position of the column value in `order`
+    (values not listed go last) or, without `order`, by the column as a
+    score, highest first. Without a column the file order is kept
+    """
+    if not column:
+        return lambda record: 0
+    if order:
+        ranks = {cell_text(value).upper(): rank for rank, value in enumerate(order)}
+        return lambda record: ranks.get(cell_text(record.get(column)).upper(), len(ranks))
+
+    def score(record):
+        try:
+            return -float(record.get(column))
+        except (TypeError, ValueError):
+            return float("inf")
+    return score
+
+
+class CampaignScheduler:
+    def __init__(self, windows=DEFAULT_WINDOWS, max_per_minute=60, daily_limit=1_000,
+                 operator_hourly_limit=None, integration_key=None, operator_id=None,
+                 priority=None, clock=time.time):
+        self.windows = tuple(windows)
+        if not self.windows:
+            raise ValueError("Nenhuma janela de envio configurada")
+        for window in self.windows:
+            if not window.start < window.end:
+                raise ValueError(f"Janela de envio inválida: {window.start:%H:%M} a {window.end:%H:%M}; "
+                                 f"o início deve ser anterior ao fim")
+            if not window.weekdays:
+                raise ValueError(f"Janela de envio sem dias da semana: {window.start:%H:%M} a {window.end:%H:%M}")
+        self.min_interval = 60.0 / max_per_minute
+        self.priority = priority or make_priority()
+        self.clock = clock
+        self.daily = shared_quota("integration", integration_key, daily_limit, DAY)
+        self.hourly = shared_quota("operator", operator_id, operator_hourly_limit, HOUR)
+        self._next_at = 0.0
+
+    def window_at(self, timestamp):
+        """(start, end) of the window containing `timestamp`, or of the next one"""
+        moment = datetime.datetime.fromtimestamp(timestamp)
+        for day in range(8):
+            date = moment.date() + datetime.timedelta(days=day)
+            bounds = sorted(
+                (datetime.datetime.combine(date, window.start).timestamp(),
+                 datetime.datetime.combine(date, window.end).timestamp())
+                for window in self.windows
+                if date.weekday() in window.weekdays
+            )
+            for start, end in bounds:
+                if end > timestamp:
+                    return start, end
+        raise ValueError("Nenhuma janela de envio configurada")
+
+    def next_slot(self, now, pending, daily=None, hourly=None):
+        """
+        When the next contact may be sent, given `pending` contacts left.
+        Returns (send_at, interval until the following send)
+        """
+        daily = daily or self.daily
+        hourly = hourly or self.hourly
+        slot = max(now, self._next_at)
+        while True:
+            start, end = self.window_at(slot)
+            slot = max(slot, start, daily.available_at(slot), hourly.available_at(slot))
+            if slot < end:
+                break
+            slot = end
+        # When the quotas cannot take every pending contact before the window
+        # closes, spread what they allow over the rest of the window instead of
+        # bursting at its start; otherwise go at the maximum rate and finish early
+        capacities = [capacity for capacity in (daily.capacity(slot, end), hourly.capacity(slot, end))
+                      if capacity is not None]
+        interval = self.min_interval
+        if capacities and min(capacities) < pending:
+            interval = max(interval, (end - slot) / max(1, min(capacities)))
+        return slot, interval
+
+    def _queue(self, records):
+        counter = itertools.count()
+        heap = [(self.priority(record), next(counter), index, record) for index, record in enumerate(records)]
+        heapq.heapify(heap)
+        return heap
+
+    def plan(self, records, start=None):
+        """Simulated send times as (send_at, index); nothing is sent or counted"""
+        heap = self._queue(records)
+        daily, hourly = self.daily.copy(), self.hourly.copy()
+        saved_next_at = self._next_at
+        now = start or self.clock()
+        schedule = []
+        try:
+            while heap:
+                _, _, index, _ = heapq.heappop(heap)
+                slot, interval = self.next_slot(now, len(heap) + 1, daily, hourly)
+                daily.add(slot)
+                hourly.add(slot)
+                self._next_at = slot + interval
+                now = slot
+                schedule.append((slot, index))
+        finally:
+            self._next_at = saved_next_at
+        return schedule
+
+    def release(self, records, should_stop=None, on_wait=None, sleep=time.sleep):
+        """
+        Yield (index, record) in priority order, each one at its slot,
+        sleeping between them. on_wait(send_at) is called before long waits
+        """
+        heap = self._queue(records)
+        while heap:
+            slot, interval = self.next_slot(self.clock(), len(heap))
+            if on_wait and slot - self.clock() > MAX_SLEEP:
+                on_wait(slot)
+            while True:
+                if should_stop and should_stop():
+                    return
+                remaining = slot - self.clock()
+                if remaining <= 0:
+                    break
+                sleep(min(remaining, MAX_SLEEP))
+            _, _, index, record = heapq.heappop(heap)
+            sent_at = self.clock()
+            self.daily.add(sent_at)
+            self.hourly.add(sent_at)
+            self._next_at = sent_at + interval
+            yield index, record
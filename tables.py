@@ -0,0 +1,35 @@
+"""
+Server-side paging of in-memory result tables (uploaded CSVs): filtering,
+sorting and slicing happen in pandas and only the visible page goes to the
+browser. Job results stored in SQLite are paged by JobRunner.query_results.
+"""
+import numpy as np
+import pandas as pd
+
+PAGE_SIZES = (25, 50, 100, 250)
+
+
+def filter_dataframe(df, search=""):
+    """Rows with `search` in any column (case-insensitive substring)"""
+    if not search:
+        return df
+    mask = np.zeros(len(df), dtype=bool)
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != object:
+            values = values.astype(str)
+        mask |= values.str.contains(search, case=False, regex=False, na=False).to_numpy()
+    return df[mask]
+
+
+def page_dataframe(df, sort_by=None, descending=False, offset=0, limit=50):
+    """Sorted slice of df for one page"""
+    if sort_by:
+        df = df.sort_values(sort_by, ascending=not descending, kind="stable", na_position="last")
+    return df.iloc[offset:offset + limit]
+
+
+def value_counts(df, column, limit=20):
+    """Rows per value of `column`, most frequent first"""
+    counts = df[column].value_counts(dropna=False).head(limit)
+    return pd.DataFrame({column: counts.index, "total": counts.to_numpy()})
@@ -1,31 +1,61 @@
 import requests
-import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+from governor import governor
+from log_utils import LazyPayload
 
 logger = logging.getLogger(__name__)
 
 class TallosAPI:
-    def __init__(self, token):
-        self.base_url = "https://api.tallos.com.br"
+    def __init__(self, token, base_url="https://api.tallos.com.br", bulk_contacts_path=None):
+        self.base_url = base_url
+        # Batch contact endpoint, if the account has one; None imports contact by contact
+        self.bulk_contacts_path = bulk_contacts_path
+        self._bulk_lock = threading.Lock()
+        # Set once the batch endpoint has answered a request successfully
+        self._bulk_checked = False
         self.headers = {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
         }
         self.token = token
 
-    def get_chat_history(self):
-        """Fetch chat history from Tallos API"""
+    def get_chat_history(self, page=1, limit=100, since=None):
+        """Fetch one page of chat history from Tallos API
+
+        Args:
+            page (int): Page number, starting at 1
+            limit (int): Messages per page
+            since (str, optional): ISO timestamp; only messages created from then on
+
+        Returns:
+            Response from API if successful, None if error
+        """
         try:
-            response = requests.get(
+            params = {
+                'page': page,
+                'limit': limit
+            }
+            if since:
+                params['since'] = since
+
+            response = governor.request(
+                "GET",
                 f"{self.base_url}/v1/chat/history",
-                headers=self.headers
+                headers=self.headers,
+                params=params,
+                endpoint="tallos GET /v1/chat/history"
             )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching chat history: {e}")
+            logger.error(f"Error fetching chat history: {e}")
             return None
 
+    @metrics.timed("tallos.send_message")
     def send_message(self, customer_id, message, operator_id=None):
         """Send a message through Tallos API
         
@@ -44,15 +74,17 @@ class TallosAPI:
                 "operator": operator_id
             }
 
-            response = requests.post(
+            response = governor.request(
+                "POST",
                 f"{self.base_url}/v2/messages/{customer_id}/send",
                 headers=self.headers,
-                json=payload
+                json=payload,
+                endpoint="tallos POST /v2/messages/{id}/send"
             )
             response.raise_for_status()
             return {"status": "success", "response": response.json()}
         except requests.exceptions.RequestException as e:
-            print(f"Error sending message: {e}")
+            logger.error(f"Error sending message: {e}")
             return {"status": "error", "message": str(e)}
 
     def get_customers(self, limit=1000, page=1, channels=None):
@@ -65,40 +97,49 @@ class TallosAPI:
             if channels:
                 params['channels'] = channels
 
-            response = requests.get(
+            response = governor.request(
+                "GET",
                 f"{self.base_url}/v2/customers",
                 headers=self.headers,
-                params=params
+                params=params,
+                endpoint="tallos GET /v2/customers"
             )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching customers: {e}")
+            logger.error(f"Error fetching customers: {e}")
             return None
     def get_employees(self):
         """Fetch employees from Tallos API"""
         try:
-            response = requests.get(
+            response = governor.request(
+                "GET",
                 f"{self.base_url}/v2/employees",
-                headers=self.headers
+                headers=self.headers,
+                max_pause=0,
+                endpoint="tallos GET /v2/employees"
             )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching employees: {e}")
+            logger.error(f"Error fetching employees: {e}")
             return None
     def get_templates(self):
         """Fetch message templates from Tallos API"""
         try:
-            response = requests.get(
+            response = governor.request(
+                "GET",
                 f"{self.base_url}/v2/template/all",
-                headers=self.headers
+                headers=self.headers,
+                max_pause=0,
+                endpoint="tallos GET /v2/template/all"
             )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching templates: {e}")
+            logger.error(f"Error fetching templates: {e}")
             return None
+    @metrics.timed("tallos.create_contact")
     def create_contact(self, contact_data):
         """Create a new contact in Tallos API
         
@@ -109,27 +150,147 @@ class TallosAPI:
             dict: Response from API if successful, None if error
         """
         try:
-            response = requests.post(
+            response = governor.request(
+                "POST",
                 f"{self.base_url}/v2/contacts/whatsapp-business-by-brokers",
                 headers=self.headers,
-                json=contact_data
+                json=contact_data,
+                endpoint="tallos POST /v2/contacts/whatsapp-business-by-brokers"
             )
-            logger.info(f"Contact data: {contact_data}")
-            logger.info(f"Response: {response.json()}")
             response.raise_for_status()
-            return response.json()
+            data = response.json()
+            logger.debug("Contact data: %s", LazyPayload(contact_data))
+            logger.debug("Response: %s", LazyPayload(data))
+            return data
         except requests.exceptions.RequestException as e:
-            print(f"Error creating contact: {e}")
+            logger.error(f"Error creating contact: {e}")
+            return None
+    def _create_contacts_bulk(self, chunk):
+        """One request for a chunk of contacts; None when the batch endpoint fails"""
+        path = self.bulk_contacts_path
+        if not path:
             return None
+        try:
+            response = governor.request(
+                "POST",
+                f"{self.base_url}{path}",
+                headers=self.headers,
+                json={"contacts": chunk},
+                endpoint=f"tallos POST {path}"
+            )
+            if response.status_code in (404, 405):
+                # Several imports may find out at once; switch over and warn only once
+                with self._bulk_lock:
+                    if self.bulk_contacts_path == path:
+                        logger.warning("Endpoint de importação em lote indisponível; importando contato a contato")
+                        self.bulk_contacts_path = None
+                return None
+            response.raise_for_status()
+            self._bulk_checked = True
+            data = response.json()
+            created = data.get("contacts", []) if isinstance(data, dict) else data
+            return created if isinstance(created, list) else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error importing contact batch: {e}")
+            return None
+
+    def _import_chunk(self, chunk):
+        ids = {}
+        failed = []
+        requests_made = 0
+
+        if self.bulk_contacts_path:
+            created = self._create_contacts_bulk(chunk)
+            requests_made += 1
+            if created is not None:
+                by_phone = {contact.get("cel_phone"): contact for contact in created if isinstance(contact, dict)}
+                for position, contact_data in enumerate(chunk):
+                    contact = by_phone.get(contact_data["cel_phone"])
+                    if contact is None and len(created) == len(chunk):
+                        contact = created[position]
+                    if isinstance(contact, dict) and contact.get("_id"):
+                        ids[contact_data["cel_phone"]] = contact["_id"]
+                # contacts missing from the batch answer are retried one by one below
+                chunk = [contact_data for contact_data in chunk if contact_data["cel_phone"] not in ids]
+
+        for contact_data in chunk:
+            response = self.create_contact(contact_data)
+            requests_made += 1
+            if response and '_id' in response:
+                ids[contact_data["cel_phone"]] = response['_id']
+            else:
+                failed.append({
+                    "cel_phone": contact_data["cel_phone"],
+                    "full_name": contact_data.get("full_name"),
+                    "error": "create_contact falhou",
+                })
+        return ids, failed, requests_made
+
+    @metrics.timed("tallos.import_contacts")
+    def import_contacts(self, contacts, chunk_size=50, max_workers=8):
+        """Create many contacts, for the send stage to use by phone
+
+        Contacts sharing a cel_phone are created once. With bulk_contacts_path
+        each chunk goes in a single request; otherwise the chunks run
+        concurrently, one create_contact per contact, paced by the governor.
+        The first chunk goes alone while the batch endpoint is untested, so
+        an account without it finds out before the other chunks fan out.
+        A failed chunk or contact does not stop the others.
+
+        Args:
+            contacts (list): create_contact payloads (full_name, cel_phone, integration)
+            chunk_size (int): Contacts per chunk
+            max_workers (int): Chunks imported at the same time
+
+        Returns:
+            dict: {"ids": {cel_phone: _id}, "failed": [...], "stats": {...}}
+        """
+        started = time.perf_counter()
+        unique = list({contact["cel_phone"]: contact for contact in contacts}.values())
+        chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+
+        ids = {}
+        failed = []
+        requests_made = 0
+        results = []
+        if chunks and self.bulk_contacts_path and not self._bulk_checked:
+            results.append(self._import_chunk(chunks[0]))
+            chunks = chunks[1:]
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)), thread_name_prefix="tallos-import") as pool:
+                results.extend(pool.map(self._import_chunk, chunks))
+        for chunk_ids, chunk_failed, chunk_requests in results:
+            ids.update(chunk_ids)
+            failed.extend(chunk_failed)
+            requests_made += chunk_requests
+
+        seconds = time.perf_counter() - started
+        stats = {
+            "contacts": len(contacts),
+            "unique": len(unique),
+            "created": len(ids),
+            "failed": len(failed),
+            "requests": requests_made,
+            "requests_avoided": len(contacts) - requests_made,
+            "seconds": round(seconds, 3),
+            "throughput_per_s": round(len(ids) / seconds, 2) if seconds else None,
+        }
+        metrics.inc("tallos_import_requests_avoided", max(0, stats["requests_avoided"]), endpoint="tallos")
+        logger.info("Importação de contatos: %s", stats)
+        return {"ids": ids, "failed": failed, "stats": stats}
+
     def get_whatsapp_integrations(self):
         """Fetch WhatsApp integrations from Tallos API"""
         try:
-            response = requests.get(
+            response = governor.request(
+                "GET",
                 f"{self.base_url}/v2/whatsapp/integrations/official",
-                headers=self.headers
+                headers=self.headers,
+                max_pause=0,
+                endpoint="tallos GET /v2/whatsapp/integrations/official"
             )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching WhatsApp integrations: {e}")
+            logger.error(f"Error fetching WhatsApp integrations: {e}")
             return None
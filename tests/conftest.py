@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_servers import MockConfig, MockServer  # noqa: E402
+from governor import HostPolicy, governor  # noqa: E402
+
+
+@pytest.fixture
+def mock_service():
+    """Start a mock service with the given MockConfig fields, unthrottled by the governor"""
+    servers = []
+
+    def start(service, **config):
+        server = MockServer(service, MockConfig(**config)).start()
+        host = server.url.split("://", 1)[1]
+        governor.policies[host] = HostPolicy(initial_rate=10_000, max_rate=10_000, burst=10_000,
+                                             failure_threshold=10_000, max_retries=0)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
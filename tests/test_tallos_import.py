@@ -0,0 +1,119 @@
+import pytest
+
+from tallos import TallosAPI
+
+BULK_PATH = "/v2/contacts/whatsapp-business-by-brokers/bulk"
+
+
+def payloads(count, repeat_every=None):
+    """create_contact payloads; with repeat_every, every n-th one repeats the previous phone"""
+    contacts = []
+    for index in range(count):
+        number = index - 1 if repeat_every and index and index % repeat_every == 0 else index
+        contacts.append({
+            "full_name": f"MEDICO {index}",
+            "cel_phone": f"+55 98 9{number:04d}-0000",
+            "integration": "int1",
+        })
+    return contacts
+
+
+def phones(contacts):
+    return {contact["cel_phone"] for contact in contacts}
+
+
+@pytest.mark.parametrize("bulk_path", [None, BULK_PATH])
+def test_maps_each_phone_to_its_contact_id(mock_service, bulk_path):
+    server = mock_service("tallos")
+    api = TallosAPI("token", base_url=server.url, bulk_contacts_path=bulk_path)
+    contacts = payloads(120)
+
+    result = api.import_contacts(contacts, chunk_size=50)
+
+    assert set(result["ids"]) == phones(contacts)
+    assert len(set(result["ids"].values())) == len(contacts)
+    assert result["failed"] == []
+    assert result["stats"]["created"] == 120
+    assert result["stats"]["requests"] == (3 if bulk_path else 120)
+
+
+@pytest.mark.parametrize("bulk_path", [None, BULK_PATH])
+def test_repeated_phones_are_created_once(mock_service, bulk_path):
+    server = mock_service("tallos")
+    api = TallosAPI("token", base_url=server.url, bulk_contacts_path=bulk_path)
+    contacts = payloads(100, repeat_every=4)
+    unique = phones(contacts)
+
+    result = api.import_contacts(contacts, chunk_size=50)
+
+    assert result["stats"]["contacts"] == 100
+    assert result["stats"]["unique"] == len(unique) == 76
+    assert set(result["ids"]) == unique
+    assert server.stats["requests"] == result["stats"]["requests"]
+    if bulk_path is None:
+        assert server.stats["requests"] == 76
+
+
+@pytest.mark.parametrize("status", [404, 405, 500])
+def test_falls_back_to_one_request_per_contact_when_bulk_fails(mock_service, status):
+    server = mock_service("tallos", bulk_status=status)
+    api = TallosAPI("token", base_url=server.url, bulk_contacts_path=BULK_PATH)
+    contacts = payloads(60)
+
+    result = api.import_contacts(contacts, chunk_size=30, max_workers=1)
+
+    assert set(result["ids"]) == phones(contacts)
+    assert result["failed"] == []
+    if status in (404, 405):
+        # Missing endpoint: disabled after the first try, the second chunk goes straight per contact
+        assert api.bulk_contacts_path is None
+        assert server.stats["bulk_requests"] == 1
+    else:
+        # Server error: the endpoint is kept and tried again for the next chunk
+        assert api.bulk_contacts_path == BULK_PATH
+        assert server.stats["bulk_requests"] == 2
+
+
+@pytest.mark.parametrize("bulk_path", [None, BULK_PATH])
+def test_failed_lists_exactly_the_rejected_contacts(mock_service, bulk_path):
+    contacts = payloads(80)
+    rejected = [contact["cel_phone"] for contact in contacts[::7]]
+    server = mock_service("tallos", rejected_phones=tuple(rejected))
+    api = TallosAPI("token", base_url=server.url, bulk_contacts_path=bulk_path)
+
+    result = api.import_contacts(contacts, chunk_size=25)
+
+    assert sorted(failure["cel_phone"] for failure in result["failed"]) == sorted(rejected)
+    assert set(result["ids"]) == phones(contacts) - set(rejected)
+    assert {failure["full_name"] for failure in result["failed"]} == {
+        contact["full_name"] for contact in contacts if contact["cel_phone"] in rejected
+    }
+    assert result["stats"]["created"] + result["stats"]["failed"] == len(contacts)
+
+
+@pytest.mark.parametrize("bulk_path", [None, BULK_PATH])
+def test_random_server_errors_split_contacts_into_ids_and_failed(mock_service, bulk_path):
+    server = mock_service("tallos", error_rate=0.2, seed=7)
+    api = TallosAPI("token", base_url=server.url, bulk_contacts_path=bulk_path)
+    contacts = payloads(90)
+
+    result = api.import_contacts(contacts, chunk_size=10)
+
+    failed = [failure["cel_phone"] for failure in result["failed"]]
+    assert len(failed) == len(set(failed))
+    assert set(result["ids"]).isdisjoint(failed)
+    assert set(result["ids"]) | set(failed) == phones(contacts)
+    assert result["failed"], "error_rate=0.2 should make some contacts fail"
+
+
+def test_missing_bulk_endpoint_is_tried_once_before_chunks_run_concurrently(mock_service):
+    server = mock_service("tallos", bulk_status=404)
+    api = TallosAPI("token", base_url=server.url, bulk_contacts_path=BULK_PATH)
+    contacts = payloads(200)
+
+    result = api.import_contacts(contacts, chunk_size=20, max_workers=8)
+
+    assert server.stats["bulk_requests"] == 1
+    assert api.bulk_contacts_path is None
+    assert set(result["ids"]) == phones(contacts)
+    assert result["failed"] == []